@@ -0,0 +1,152 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+from dotenv import load_dotenv
+from .instrumentation import ALERT_EMAILS, ALERT_QUEUE_DEPTH
+
+if TYPE_CHECKING:
+    from email.mime.text import MIMEText
+
+load_dotenv()
+
+# --- Configurações --- #
+SMTP_SERVER = os.getenv("SMTP_SERVER")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+RECIPIENT_EMAIL = os.getenv("RECIPIENT_EMAIL")
+ALERT_DIGEST_WINDOW = float(os.getenv("ALERT_DIGEST_WINDOW", 30))  # segundos de agregação por email
+ALERT_QUEUE_MAX = int(os.getenv("ALERT_QUEUE_MAX", 10000))
+
+def smtp_configured() -> bool:
+    return all([SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, RECIPIENT_EMAIL])
+
+def build_alert_message(transitions: list) -> "MIMEText":
+    """Monta um único email com todas as transições para Offline da janela."""
+    from email.mime.text import MIMEText  # só carregado quando há um alerta a enviar
+    if len(transitions) == 1:
+        node_name, ip_address, _ = transitions[0]
+        subject = f"Alerta: Nó {node_name} está Offline"
+        body = f"O nó {node_name} com o endereço IP {ip_address} foi detectado como offline. Por favor, verifique."
+    else:
+        subject = f"Alerta: {len(transitions)} nós estão Offline"
+        lines = [f"- {node_name} ({ip_address}) às {detected_at:%d/%m/%Y %H:%M:%S} UTC" for node_name, ip_address, detected_at in transitions]
+        body = f"Os seguintes {len(transitions)} nós foram detectados como offline. Por favor, verifique.\n\n" + "\n".join(lines)
+
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    msg['From'] = SMTP_USER
+    msg['To'] = RECIPIENT_EMAIL
+    return msg
+
+class AlertDispatcher:
+    """
+    Fila de alertas desacoplada da verificação: enqueue() nunca bloqueia, e uma
+    tarefa em segundo plano agrega as transições de cada janela de
+    ALERT_DIGEST_WINDOW segundos num único email, enviado fora do event loop
+    através de uma sessão SMTP reutilizada.
+    """
+
+    def __init__(self, window: float = ALERT_DIGEST_WINDOW, max_queue: int = ALERT_QUEUE_MAX):
+        self.window = window
+        self.max_queue = max_queue
+        self._queue_obj = None
+        self._smtp = None
+        self._task = None
+        self.sent_digests = 0
+        self.dropped = 0
+
+    @property
+    def _queue(self) -> asyncio.Queue:
+        # Criada sob demanda, já dentro do event loop que a vai usar
+        if self._queue_obj is None:
+            self._queue_obj = asyncio.Queue(maxsize=self.max_queue)
+        return self._queue_obj
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue_obj.qsize() if self._queue_obj else 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Envia o que ainda estiver na fila antes de encerrar
+        pending = self._drain()
+        if pending:
+            await self._send_digest(pending)
+        await asyncio.get_running_loop().run_in_executor(None, self._close_smtp)
+
+    def enqueue(self, node_name: str, ip_address: str):
+        try:
+            self._queue.put_nowait((node_name, ip_address, datetime.now(timezone.utc)))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logging.error(f"Fila de alertas cheia ({self.max_queue}); alerta do nó {node_name} descartado.")
+
+    def _drain(self) -> list:
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        return items
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            await asyncio.sleep(self.window)
+            await self._send_digest([first] + self._drain())
+
+    async def _send_digest(self, transitions: list):
+        if not smtp_configured():
+            logging.warning(f"Configurações de SMTP não encontradas. Pulando o envio de {len(transitions)} alertas.")
+            ALERT_EMAILS.labels("skipped").inc()
+            return
+        msg = build_alert_message(transitions)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._send, msg)
+            self.sent_digests += 1
+            ALERT_EMAILS.labels("sent").inc()
+            logging.info(f"Email de alerta enviado para {RECIPIENT_EMAIL} com {len(transitions)} nós offline.")
+        except Exception as e:
+            ALERT_EMAILS.labels("failed").inc()
+            logging.error(f"Falha ao enviar email de alerta: {e}")
+
+    def _send(self, msg: "MIMEText"):
+        import smtplib  # corre no executor: o import não pesa no arranque nem no event loop
+        # Reaproveita a sessão SMTP; se o servidor a fechou por inatividade, reconecta uma vez
+        for attempt in range(2):
+            try:
+                if self._smtp is None:
+                    self._smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
+                    self._smtp.starttls()
+                    self._smtp.login(SMTP_USER, SMTP_PASSWORD)
+                self._smtp.send_message(msg)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if attempt:
+                    raise
+            except Exception:
+                self._close_smtp()
+                raise
+
+    def _close_smtp(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+alert_dispatcher = AlertDispatcher()
+ALERT_QUEUE_DEPTH.set_function(lambda: alert_dispatcher.queue_depth)
@@ -0,0 +1,68 @@
+from typing import List, Optional
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .models import Node, NodeDeletion, NodeVersionCounter
+
+def next_node_version(db: Session) -> int:
+    """
+    Reserva a próxima versão da tabela nodes. O UPDATE no contador mantém a
+    linha bloqueada até ao commit, por isso as versões ficam visíveis pela
+    mesma ordem em que são atribuídas, mesmo com vários workers a gravar.
+    """
+    counter = NodeVersionCounter.__table__
+    updated = db.execute(counter.update().where(counter.c.id == 1).values(value=counter.c.value + 1)).rowcount
+    if not updated:
+        try:
+            with db.begin_nested():
+                db.execute(counter.insert().values(id=1, value=1))
+            return 1
+        except IntegrityError:
+            # Outro processo criou o contador ao mesmo tempo
+            db.execute(counter.update().where(counter.c.id == 1).values(value=counter.c.value + 1))
+    return db.query(NodeVersionCounter.value).filter(NodeVersionCounter.id == 1).scalar()
+
+def current_node_version(db: Session) -> int:
+    return db.query(NodeVersionCounter.value).filter(NodeVersionCounter.id == 1).scalar() or 0
+
+def record_node_deletions(db: Session, nodes: List[Node]):
+    """Regista a remoção dos nós, com uma versão nova, antes de os apagar."""
+    if not nodes:
+        return
+    version = next_node_version(db)
+    for node in nodes:
+        db.merge(NodeDeletion(node_id=node.id, network=node.network, row_version=version))
+
+def node_change_events(db: Session, since: int) -> tuple:
+    """
+    Como node_changes_since, mas para todas as redes e com a versão de cada
+    evento: devolve (versão, [(row_version, node_id, rede, nó ou None se apagado)]).
+    """
+    version = current_node_version(db)
+    if version <= since:
+        return version, []
+    events = [
+        (node.row_version, node.id, node.network, node)
+        for node in db.query(Node).filter(Node.row_version > since, Node.row_version <= version)
+    ]
+    events += [
+        (row_version, node_id, network, None)
+        for row_version, node_id, network in db.query(NodeDeletion.row_version, NodeDeletion.node_id, NodeDeletion.network).filter(
+            NodeDeletion.row_version > since, NodeDeletion.row_version <= version
+        )
+    ]
+    events.sort(key=lambda event: event[0])
+    return version, events
+
+def node_changes_since(db: Session, since: int, network: Optional[str] = None) -> dict:
+    # Lê a versão antes dos dados: uma alteração concorrente aparece agora ou na próxima consulta, nunca se perde
+    version = current_node_version(db)
+    changed = db.query(Node).filter(Node.row_version > since, Node.row_version <= version)
+    deleted = db.query(NodeDeletion.node_id).filter(NodeDeletion.row_version > since, NodeDeletion.row_version <= version)
+    if network:
+        changed = changed.filter(Node.network == network)
+        deleted = deleted.filter(NodeDeletion.network == network)
+    return {
+        "version": version,
+        "changed": changed.order_by(Node.row_version, Node.id).all(),
+        "deleted": [row[0] for row in deleted.all()],
+    }
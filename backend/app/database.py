@@ -0,0 +1,145 @@
+import os
+import asyncio
+import logging
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.exc import SQLAlchemyError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Driver assíncrono do mesmo banco; por omissão deriva de DATABASE_URL (postgresql -> asyncpg, sqlite -> aiosqlite)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+# Espera pela base de dados no arranque: DB_CONNECT_RETRIES tentativas, com pausas de DB_CONNECT_BACKOFF
+# segundos que dobram a cada falha até DB_CONNECT_BACKOFF_MAX (0,5 + 1 + 2 + 4 + 8 + 10... ≈ 1 min por omissão)
+DB_CONNECT_RETRIES = int(os.getenv("DB_CONNECT_RETRIES", 10))
+DB_CONNECT_BACKOFF = float(os.getenv("DB_CONNECT_BACKOFF", 0.5))
+DB_CONNECT_BACKOFF_MAX = float(os.getenv("DB_CONNECT_BACKOFF_MAX", 10))
+
+# --- Base de Dados --- #
+# Os engines (e o import dos drivers) só são criados na primeira sessão ou conexão, nunca no import deste módulo
+Base = declarative_base()
+_engine = None
+_session_factory = sessionmaker(autocommit=False, autoflush=False)
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+        _session_factory.configure(bind=_engine)
+    return _engine
+
+def SessionLocal() -> Session:
+    get_engine()
+    return _session_factory()
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# --- Base de Dados Assíncrona --- #
+# Usada pelo código que corre no event loop (poller, endpoints async): as idas
+# ao banco não bloqueiam o loop. O `get_db` síncrono fica para os endpoints
+# `def` (que o FastAPI corre no threadpool) e para os jobs em executor.
+_ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+def _async_url(url: str):
+    url = make_url(url)
+    driver = _ASYNC_DRIVERS.get(url.get_backend_name())
+    return url.set(drivername=driver) if driver else url
+
+_async_engine = None
+# expire_on_commit=False: os objetos continuam legíveis depois do commit sem novo SELECT (lazy loads não existem em async)
+_async_session_factory = async_sessionmaker(class_=AsyncSession, expire_on_commit=False)
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_engine(ASYNC_DATABASE_URL or _async_url(DATABASE_URL), pool_pre_ping=True)
+        _async_session_factory.configure(bind=_async_engine)
+    return _async_engine
+
+def AsyncSessionLocal() -> AsyncSession:
+    get_async_engine()
+    return _async_session_factory()
+
+async def dispose_async_engine():
+    """Fecha as conexões do pool assíncrono (presas ao event loop atual), se o engine chegou a ser criado."""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# --- Esquema e Arranque --- #
+def _apply_schema(conn):
+    """
+    Cria as tabelas em falta e também as colunas e índices adicionados depois
+    da criação de uma tabela, que o create_all sozinho não aplica.
+    """
+    from . import models  # noqa: F401  (regista os modelos no metadata)
+    Base.metadata.create_all(bind=conn)
+    _add_missing_columns(conn)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+def _add_missing_columns(conn):
+    inspector = inspect(conn)
+    quote = conn.dialect.identifier_preparer.quote
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(dialect=conn.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg.text}"
+            conn.execute(text(ddl))
+            logging.info(f"Coluna {table.name}.{column.name} adicionada à base de dados.")
+
+def create_schema():
+    """Versão síncrona de prepare_database, sem espera: para scripts e benchmarks."""
+    with get_engine().begin() as conn:
+        _apply_schema(conn)
+
+async def ping_database() -> bool:
+    try:
+        async with get_async_engine().connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        return True
+    except (OSError, SQLAlchemyError):
+        return False
+
+async def wait_for_database():
+    """Espera que a base de dados aceite conexões, com backoff exponencial e sem bloquear o event loop."""
+    delay = DB_CONNECT_BACKOFF
+    for attempt in range(1, DB_CONNECT_RETRIES + 1):
+        try:
+            async with get_async_engine().connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            logging.info("Conexão com a base de dados estabelecida com sucesso.")
+            return
+        except (OSError, SQLAlchemyError) as e:
+            logging.error(f"Tentativa {attempt}/{DB_CONNECT_RETRIES} falhou ao conectar na base de dados: {e}")
+            if attempt == DB_CONNECT_RETRIES:
+                logging.error("Não foi possível conectar à base de dados após várias tentativas.")
+                raise
+            logging.info(f"Aguardando {delay:g} segundos para a próxima tentativa...")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, DB_CONNECT_BACKOFF_MAX)
+
+async def prepare_database():
+    """Espera pela base de dados e aplica o esquema uma única vez, numa transação do driver assíncrono."""
+    await wait_for_database()
+    async with get_async_engine().begin() as conn:
+        await conn.run_sync(_apply_schema)
@@ -0,0 +1,149 @@
+import os
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List
+from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import IpLocation, Node
+from .changes import next_node_version
+from .instrumentation import EXTERNAL_REQUESTS
+
+load_dotenv()
+
+# --- Configurações --- #
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH")  # ficheiro .mmdb (ex.: GeoLite2-City.mmdb), opcional
+GEO_CACHE_TTL_DAYS = int(os.getenv("GEO_CACHE_TTL_DAYS", 30))
+GEO_CACHE_MISS_TTL_HOURS = int(os.getenv("GEO_CACHE_MISS_TTL_HOURS", 24))
+GEO_FILL_INTERVAL = int(os.getenv("GEO_FILL_INTERVAL", 600))
+IP_API_BATCH_URL = "http://ip-api.com/batch"
+IP_API_BATCH_SIZE = 100  # máximo de IPs por pedido em lote no ip-api.com
+
+LOCATION_PENDING = "A ser verificado"
+LOCATION_NOT_FOUND = "Localização não encontrada"
+
+_geoip_reader = None
+_geoip_reader_loaded = False
+
+def _get_geoip_reader():
+    global _geoip_reader, _geoip_reader_loaded
+    if not _geoip_reader_loaded:
+        _geoip_reader_loaded = True
+        try:
+            import maxminddb  # opcional e só carregado no primeiro uso; sem ele usa-se a cache e a API remota
+        except ImportError:
+            maxminddb = None
+        if GEOIP_DB_PATH and maxminddb is None:
+            logging.warning("GEOIP_DB_PATH definido, mas o pacote maxminddb não está instalado; a usar só a API remota.")
+        elif GEOIP_DB_PATH:
+            try:
+                _geoip_reader = maxminddb.open_database(GEOIP_DB_PATH)
+                logging.info(f"Base de dados GeoIP local carregada: {GEOIP_DB_PATH}")
+            except (OSError, ValueError) as e:
+                logging.error(f"Não foi possível abrir a base de dados GeoIP {GEOIP_DB_PATH}: {e}")
+    return _geoip_reader
+
+def _format_location(city: str, country: str) -> str:
+    return f"{city}, {country}"
+
+def _lookup_local(ip: str):
+    reader = _get_geoip_reader()
+    if reader is None:
+        return None
+    try:
+        record = reader.get(ip)
+    except ValueError:  # IP inválido
+        return None
+    if not record or 'country' not in record:
+        return None
+    city = record.get('city', {}).get('names', {}).get('en', '')
+    country = record['country'].get('names', {}).get('en', '')
+    return _format_location(city, country)
+
+def fetch_remote_locations(ips: List[str]) -> dict:
+    """Consulta o ip-api.com em lotes de 100. IPs de lotes que falharam ficam de fora do resultado."""
+    import requests  # só a geolocalização remota (em segundo plano) o usa
+    locations = {}
+    for i in range(0, len(ips), IP_API_BATCH_SIZE):
+        batch = ips[i:i + IP_API_BATCH_SIZE]
+        try:
+            response = requests.post(IP_API_BATCH_URL, json=batch, timeout=15)
+            response.raise_for_status()
+            EXTERNAL_REQUESTS.labels("ip-api", "ok").inc()
+            for item in response.json():
+                query = item.get('query')
+                if item.get('status') == 'success':
+                    locations[query] = _format_location(item.get('city', ''), item.get('country', ''))
+                else:
+                    locations[query] = None
+        except (requests.RequestException, ValueError) as e:
+            EXTERNAL_REQUESTS.labels("ip-api", "error").inc()
+            logging.error(f"Erro ao buscar geolocalização em lote: {e}")
+            continue
+        # Plano gratuito limitado por minuto: o cabeçalho X-Rl indica os pedidos restantes, X-Ttl quando a janela reinicia
+        if response.headers.get('X-Rl') == '0' and i + IP_API_BATCH_SIZE < len(ips):
+            time.sleep(int(response.headers.get('X-Ttl', 60)) + 1)
+    return locations
+
+def resolve_locations(db: Session, ips: Iterable[str], allow_remote: bool = False) -> dict:
+    """
+    Resolve a localização de cada IP pela cache, depois pela base .mmdb local
+    e, se allow_remote, pelo ip-api.com. IPs sem resposta ficam de fora do
+    dicionário devolvido.
+    """
+    ips = list(dict.fromkeys(ips))
+    if not ips:
+        return {}
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    locations = {}
+    for i in range(0, len(ips), 1000):
+        for entry in db.query(IpLocation).filter(IpLocation.ip_address.in_(ips[i:i + 1000])):
+            ttl = timedelta(days=GEO_CACHE_TTL_DAYS) if entry.found else timedelta(hours=GEO_CACHE_MISS_TTL_HOURS)
+            if entry.updated_at > now - ttl:
+                locations[entry.ip_address] = entry.location
+
+    for ip in ips:
+        if ip not in locations:
+            location = _lookup_local(ip)
+            if location is not None:
+                locations[ip] = location
+
+    missing = [ip for ip in ips if ip not in locations]
+    if missing and allow_remote:
+        remote = fetch_remote_locations(missing)
+        for ip, location in remote.items():
+            db.merge(IpLocation(
+                ip_address=ip, location=location or LOCATION_NOT_FOUND, found=location is not None,
+                source="ip-api", updated_at=now,
+            ))
+            locations[ip] = location or LOCATION_NOT_FOUND
+        db.commit()
+    return locations
+
+def fill_pending_locations(node_ids: List[int] = None):
+    """
+    Preenche a localização dos nós que ainda têm o valor provisório, usando a
+    API remota para o que a cache e a base local não resolverem. Corre fora do
+    pedido (tarefa em segundo plano ou job periódico), nunca no caminho de criação.
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(Node.id, Node.ip_address).filter(Node.location == LOCATION_PENDING)
+        if node_ids is not None:
+            query = query.filter(Node.id.in_(node_ids))
+        pending = query.all()
+        if not pending:
+            return
+        locations = resolve_locations(db, [ip for _, ip in pending], allow_remote=True)
+        resolved = [(node_id, locations[ip]) for node_id, ip in pending if ip in locations]
+        if resolved:
+            version = next_node_version(db)
+            db.bulk_update_mappings(Node, [{'id': node_id, 'location': location, 'row_version': version} for node_id, location in resolved])
+            db.commit()
+        logging.info(f"Geolocalização em segundo plano: {len(resolved)} de {len(pending)} nós pendentes resolvidos.")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Falha ao preencher a geolocalização dos nós: {e}")
+    finally:
+        db.close()
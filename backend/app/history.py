@@ -0,0 +1,215 @@
+import os
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import HEALTHY_STATUSES, NodeStatusRollup, NodeStatusSample
+
+load_dotenv()
+
+# --- Configurações --- #
+HISTORY_RAW_RETENTION_DAYS = int(os.getenv("HISTORY_RAW_RETENTION_DAYS", 7))
+HISTORY_5M_RETENTION_DAYS = int(os.getenv("HISTORY_5M_RETENTION_DAYS", 90))
+HISTORY_1H_RETENTION_DAYS = int(os.getenv("HISTORY_1H_RETENTION_DAYS", 730))
+HISTORY_MAINTENANCE_INTERVAL = int(os.getenv("HISTORY_MAINTENANCE_INTERVAL", 300))
+# Máximo de tempo agregado por execução, para que um atraso longo não gere uma única transação enorme
+HISTORY_ROLLUP_MAX_WINDOW = timedelta(days=1)
+# Um balde só é agregado este tempo depois de fechar: sampled_at é a hora da verificação, e o lote
+# de outro worker pode ser gravado (commit) alguns segundos depois de o balde já ter sido agregado
+HISTORY_ROLLUP_GRACE = timedelta(seconds=int(os.getenv("HISTORY_ROLLUP_GRACE", 60)))
+
+HISTORY_RESOLUTIONS = {"auto": None, "raw": 0, "5m": 300, "1h": 3600}
+_RETENTION_DAYS = {0: HISTORY_RAW_RETENTION_DAYS, 300: HISTORY_5M_RETENTION_DAYS, 3600: HISTORY_1H_RETENTION_DAYS}
+_EPOCH = datetime(1970, 1, 1)
+
+def _utc_naive(dt: datetime) -> datetime:
+    """As colunas de data não guardam fuso: tudo é gravado e comparado em UTC sem tzinfo."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _floor(dt: datetime, seconds: int) -> datetime:
+    elapsed = int((dt - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=elapsed - elapsed % seconds)
+
+def record_samples(db: Session, samples: list, sampled_at: datetime):
+    """Anexa uma amostra por resultado de verificação. O commit fica a cargo de quem chama."""
+    if not samples:
+        return
+    sampled_at = _utc_naive(sampled_at)
+    rows = []
+    for node_id, new_status in samples:
+        metrics = new_status.get('metrics') or {}
+        rows.append({
+            'node_id': node_id, 'sampled_at': sampled_at, 'status': new_status['status'], 'currentBlock': new_status['currentBlock'],
+            'connect_ms': metrics.get('connect_ms'), 'rpc_ms': metrics.get('rpc_ms'), 'failure': metrics.get('failure'),
+        })
+    db.bulk_insert_mappings(NodeStatusSample, rows)
+
+# --- Agregação e Retenção --- #
+def _aggregate(rows, resolution: int) -> list:
+    """
+    Agrupa linhas (node_id, instante, status, bloco mín., bloco máx., amostras, online,
+    amostras com latência, soma da latência, latência máx.) em baldes da resolução pedida.
+    """
+    buckets = defaultdict(lambda: {
+        'samples': 0, 'online_samples': 0, 'min_block': None, 'max_block': None, 'last_status': None,
+        'rtt_samples': 0, 'rtt_ms_sum': 0, 'max_rtt_ms': None,
+    })
+    for node_id, timestamp, status, min_block, max_block, samples, online_samples, rtt_samples, rtt_ms_sum, max_rtt_ms in rows:
+        bucket = buckets[(node_id, _floor(timestamp, resolution))]
+        bucket['samples'] += samples
+        bucket['online_samples'] += online_samples
+        bucket['rtt_samples'] += rtt_samples or 0
+        bucket['rtt_ms_sum'] += rtt_ms_sum or 0
+        if max_rtt_ms is not None:
+            bucket['max_rtt_ms'] = max_rtt_ms if bucket['max_rtt_ms'] is None else max(bucket['max_rtt_ms'], max_rtt_ms)
+        if min_block is not None:
+            bucket['min_block'] = min_block if bucket['min_block'] is None else min(bucket['min_block'], min_block)
+        if max_block is not None:
+            bucket['max_block'] = max_block if bucket['max_block'] is None else max(bucket['max_block'], max_block)
+        bucket['last_status'] = status  # as linhas chegam ordenadas por tempo
+    return [
+        {'node_id': node_id, 'resolution': resolution, 'bucket_start': bucket_start, **values}
+        for (node_id, bucket_start), values in buckets.items()
+    ]
+
+def _rollup(db: Session, resolution: int, now: datetime) -> int:
+    """Agrega os baldes completos ainda não processados, a partir das amostras brutas (5 min) ou dos agregados de 5 min (1 h)."""
+    end = _floor(now - HISTORY_ROLLUP_GRACE, resolution)
+    last_bucket = db.query(func.max(NodeStatusRollup.bucket_start)).filter(NodeStatusRollup.resolution == resolution).scalar()
+    # Começa no primeiro dado ainda não agregado, saltando lacunas sem amostras (ex.: poller parado mais de um dia)
+    if resolution == 300:
+        pending = db.query(func.min(NodeStatusSample.sampled_at))
+        if last_bucket is not None:
+            pending = pending.filter(NodeStatusSample.sampled_at >= last_bucket + timedelta(seconds=resolution))
+    else:
+        pending = db.query(func.min(NodeStatusRollup.bucket_start)).filter(NodeStatusRollup.resolution == 300)
+        if last_bucket is not None:
+            pending = pending.filter(NodeStatusRollup.bucket_start >= last_bucket + timedelta(seconds=resolution))
+    first = pending.scalar()
+    if first is None:
+        return 0
+    start = _floor(first, resolution)
+    if resolution == 3600:
+        # Só agrega horas cujos baldes de 5 min já estão todos fechados
+        last_5m = db.query(func.max(NodeStatusRollup.bucket_start)).filter(NodeStatusRollup.resolution == 300).scalar()
+        end = min(end, _floor(last_5m + timedelta(seconds=300), resolution)) if last_5m else start
+    end = min(end, start + HISTORY_ROLLUP_MAX_WINDOW)
+    if start >= end:
+        return 0
+
+    if resolution == 300:
+        query = db.query(
+            NodeStatusSample.node_id, NodeStatusSample.sampled_at, NodeStatusSample.status, NodeStatusSample.currentBlock,
+            func.coalesce(NodeStatusSample.rpc_ms, NodeStatusSample.connect_ms),
+        ).filter(
+            NodeStatusSample.sampled_at >= start, NodeStatusSample.sampled_at < end
+        ).order_by(NodeStatusSample.sampled_at)
+        rows = (
+            (node_id, ts, status, block, block, 1, int(status in HEALTHY_STATUSES), int(rtt is not None), rtt, rtt)
+            for node_id, ts, status, block, rtt in query.yield_per(5000)
+        )
+    else:
+        query = db.query(NodeStatusRollup).filter(
+            NodeStatusRollup.resolution == 300, NodeStatusRollup.bucket_start >= start, NodeStatusRollup.bucket_start < end
+        ).order_by(NodeStatusRollup.bucket_start)
+        rows = (
+            (r.node_id, r.bucket_start, r.last_status, r.min_block, r.max_block, r.samples, r.online_samples, r.rtt_samples, r.rtt_ms_sum, r.max_rtt_ms)
+            for r in query.yield_per(5000)
+        )
+    rollups = _aggregate(rows, resolution)
+
+    # Idempotente: refaz os baldes da janela caso uma execução anterior tenha falhado a meio
+    db.query(NodeStatusRollup).filter(
+        NodeStatusRollup.resolution == resolution, NodeStatusRollup.bucket_start >= start, NodeStatusRollup.bucket_start < end
+    ).delete(synchronize_session=False)
+    if rollups:
+        db.bulk_insert_mappings(NodeStatusRollup, rollups)
+    db.commit()
+    return len(rollups)
+
+def _apply_retention(db: Session, now: datetime) -> int:
+    deleted = db.query(NodeStatusSample).filter(
+        NodeStatusSample.sampled_at < now - timedelta(days=HISTORY_RAW_RETENTION_DAYS)
+    ).delete(synchronize_session=False)
+    for resolution in (300, 3600):
+        deleted += db.query(NodeStatusRollup).filter(
+            NodeStatusRollup.resolution == resolution,
+            NodeStatusRollup.bucket_start < now - timedelta(days=_RETENTION_DAYS[resolution]),
+        ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def run_history_maintenance():
+    """Agrega o histórico em baldes de 5 min e de 1 h e apaga o que passou da retenção. Síncrona: corre fora do event loop."""
+    now = _utc_naive(datetime.now(timezone.utc))
+    db = SessionLocal()
+    try:
+        rollups_5m = _rollup(db, 300, now)
+        rollups_1h = _rollup(db, 3600, now)
+        deleted = _apply_retention(db, now)
+        logging.info(f"Manutenção do histórico: {rollups_5m} agregados de 5 min, {rollups_1h} de 1 h, {deleted} linhas expiradas removidas.")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Falha na manutenção do histórico de status: {e}")
+    finally:
+        db.close()
+
+# --- Consulta --- #
+def _pick_resolution(start: datetime, end: datetime, now: datetime) -> int:
+    span = end - start
+    if span <= timedelta(days=1) and start >= now - timedelta(days=HISTORY_RAW_RETENTION_DAYS):
+        return 0
+    if span <= timedelta(days=30) and start >= now - timedelta(days=HISTORY_5M_RETENTION_DAYS):
+        return 300
+    return 3600
+
+def query_history(db: Session, node_id: int, start: datetime, end: datetime, resolution: str = "auto") -> dict:
+    now = _utc_naive(datetime.now(timezone.utc))
+    start, end = _utc_naive(start), _utc_naive(end)
+    seconds = HISTORY_RESOLUTIONS[resolution]
+    if seconds is None:
+        seconds = _pick_resolution(start, end, now)
+
+    if seconds == 0:
+        rows = db.query(
+            NodeStatusSample.sampled_at, NodeStatusSample.status, NodeStatusSample.currentBlock,
+            NodeStatusSample.connect_ms, NodeStatusSample.rpc_ms, NodeStatusSample.failure,
+        ).filter(
+            NodeStatusSample.node_id == node_id, NodeStatusSample.sampled_at >= start, NodeStatusSample.sampled_at < end
+        ).order_by(NodeStatusSample.sampled_at).all()
+        points = [
+            {"timestamp": ts, "status": status, "currentBlock": block, "connect_ms": connect_ms, "rpc_ms": rpc_ms, "failure": failure}
+            for ts, status, block, connect_ms, rpc_ms, failure in rows
+        ]
+        total = len(points)
+        online = sum(1 for point in points if point["status"] in HEALTHY_STATUSES)
+    else:
+        rows = db.query(NodeStatusRollup).filter(
+            NodeStatusRollup.node_id == node_id, NodeStatusRollup.resolution == seconds,
+            NodeStatusRollup.bucket_start >= _floor(start, seconds), NodeStatusRollup.bucket_start < end,
+        ).order_by(NodeStatusRollup.bucket_start).all()
+        points = [
+            {
+                "timestamp": r.bucket_start, "samples": r.samples, "uptime": r.online_samples / r.samples if r.samples else None,
+                "min_block": r.min_block, "max_block": r.max_block, "status": r.last_status,
+                "avg_rtt_ms": r.rtt_ms_sum / r.rtt_samples if r.rtt_samples else None, "max_rtt_ms": r.max_rtt_ms,
+            }
+            for r in rows
+        ]
+        total = sum(r.samples for r in rows)
+        online = sum(r.online_samples for r in rows)
+
+    return {
+        "node_id": node_id,
+        "resolution": {0: "raw", 300: "5m", 3600: "1h"}[seconds],
+        "start": start,
+        "end": end,
+        "samples": total,
+        "uptime": online / total if total else None,
+        "points": points,
+    }
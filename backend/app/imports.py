@@ -0,0 +1,372 @@
+import os
+import csv
+import socket
+import codecs
+import json
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import List, Set
+from pydantic import ValidationError
+from dotenv import load_dotenv
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import ImportJob, ImportRow, Node
+from .changes import next_node_version
+from .geolocation import LOCATION_PENDING, fill_pending_locations, resolve_locations
+from .instrumentation import DB_WRITE_DURATION
+
+load_dotenv()
+
+# --- Configurações --- #
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))  # linhas por INSERT ... ON CONFLICT
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", 1))  # importações simultâneas por processo da API
+IMPORT_MAX_ERRORS = 100
+IMPORT_ANALYSIS_TTL_HOURS = int(os.getenv("IMPORT_ANALYSIS_TTL_HOURS", 24))  # análises não confirmadas são apagadas depois disto
+IMPORT_JOB_RETENTION_DAYS = int(os.getenv("IMPORT_JOB_RETENTION_DAYS", 7))  # jobs concluídos ou falhados são apagados depois disto
+IMPORT_HEARTBEAT_INTERVAL = int(os.getenv("IMPORT_HEARTBEAT_INTERVAL", 30))
+IMPORT_HEARTBEAT_TTL = int(os.getenv("IMPORT_HEARTBEAT_TTL", 120))  # sem sinal de vida durante isto, o processo dono do job parou
+
+REQUIRED_CSV_COLUMNS = {'name', 'ip_address', 'wallet_address', 'vps_provider', 'network'}
+NODE_IMPORT_FIELDS = ("name", "ip_address", "secondary_ip", "vps_provider", "wallet_address", "network")
+
+class CsvImportError(ValueError):
+    """Erro de conteúdo do CSV ou do pedido de importação, devolvido ao cliente como 400."""
+
+_executor = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Executor próprio: as importações não ocupam as threads dos endpoints síncronos nem o event loop
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="import-job")
+    return _executor
+
+def shutdown_import_executor():
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# Dono dos jobs submetidos neste processo; o sufixo distingue reinícios com o mesmo PID (ex.: PID 1 num contentor)
+_PROCESS_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+def submit_import_job(db: Session, nodes_to_create: List[dict], nodes_to_update: List[dict]) -> ImportJob:
+    """Regista o job e entrega a importação ao executor; devolve logo, sem esperar pelo trabalho."""
+    job = ImportJob(
+        id=uuid.uuid4().hex, status="queued", total_rows=len(nodes_to_create) + len(nodes_to_update),
+        errors="[]", created_at=_utc_now(), owner=_PROCESS_ID, heartbeat_at=_utc_now(),
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    _get_executor().submit(run_import_job, job.id, nodes_to_create, nodes_to_update)
+    return job
+
+def _add_error(job: ImportJob, errors: list, message: str, log: bool = True):
+    if log:
+        logging.error(f"Importação {job.id}: {message}")
+    if len(errors) < IMPORT_MAX_ERRORS:
+        errors.append(message)
+        job.errors = json.dumps(errors)
+
+@DB_WRITE_DURATION.labels("import_upsert").time()
+def upsert_nodes(db: Session, rows: List[dict], locations: dict, overwrite: bool) -> int:
+    """
+    Grava um lote inteiro num único INSERT ... ON CONFLICT (ip_address).
+    Com overwrite, os IPs existentes recebem os dados do CSV (a localização é
+    mantida); sem ele, são ignorados. Devolve o número de linhas gravadas.
+    """
+    if not rows:
+        return 0
+    # Um IP repetido no mesmo lote faria o ON CONFLICT DO UPDATE falhar no Postgres; vale a última linha
+    rows = list({row['ip_address']: row for row in rows}.values())
+    insert = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    version = next_node_version(db)
+    table = Node.__table__
+    stmt = insert(table)
+    if overwrite:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.ip_address],
+            set_={key: stmt.excluded[key] for key in (*rows[0].keys(), 'row_version') if key != 'ip_address'},
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[table.c.ip_address])
+    # Lista de parâmetros em vez de .values(): a instrução compilada fica em cache e o SQLAlchemy envia-a em
+    # INSERTs de várias linhas ("insertmanyvalues"); o RETURNING conta as linhas realmente gravadas
+    result = db.execute(stmt.returning(table.c.id), [
+        {**row, 'location': locations.get(row['ip_address'], LOCATION_PENDING), 'row_version': version}
+        for row in rows
+    ])
+    return len(result.all())
+
+def _list_chunks(nodes_to_create: List[dict], nodes_to_update: List[dict]):
+    for label, rows, overwrite in (("Nós novos", nodes_to_create, False), ("Nós atualizados", nodes_to_update, True)):
+        for i in range(0, len(rows), IMPORT_BATCH_SIZE):
+            batch = rows[i:i + IMPORT_BATCH_SIZE]
+            yield f"{label} {i + 1}-{i + len(batch)}", batch, overwrite, len(batch)
+
+def _staged_chunks(db: Session, job_id: str, overwrite_duplicates: bool, skip_ips: Set[str]):
+    """Lê as linhas analisadas por keyset, um lote de cada vez, sem carregar o ficheiro inteiro."""
+    kinds = [("new", False)] + ([("duplicate", True)] if overwrite_duplicates else [])
+    for kind, overwrite in kinds:
+        last_id = 0
+        while True:
+            rows = db.query(ImportRow).filter(
+                ImportRow.job_id == job_id, ImportRow.kind == kind, ImportRow.id > last_id,
+            ).order_by(ImportRow.id).limit(IMPORT_BATCH_SIZE).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            batch = [_row_data(row) for row in rows if row.ip_address not in skip_ips]
+            yield f"Linhas {rows[0].line}-{rows[-1].line}", batch, overwrite, len(rows)
+
+def _run_job(job_id: str, chunks) -> bool:
+    """Grava os lotes de `chunks`, atualizando o progresso do job. Devolve True se ficaram geolocalizações pendentes."""
+    db = SessionLocal()
+    errors = []
+    pending_locations = False
+    try:
+        job = db.get(ImportJob, job_id)
+        job.status = "running"
+        job.errors = "[]"  # os erros da análise já foram mostrados; a partir daqui só os da gravação
+        job.started_at = job.heartbeat_at = _utc_now()
+        db.commit()
+
+        for label, batch, overwrite, row_count in chunks(db):
+            try:
+                locations = resolve_locations(db, [node['ip_address'] for node in batch])
+                pending_locations = pending_locations or len(locations) < len({node['ip_address'] for node in batch})
+                written = upsert_nodes(db, batch, locations, overwrite)
+                if overwrite:
+                    job.updated_rows += written
+                else:
+                    job.created_rows += written
+                    if written < len(batch):
+                        _add_error(job, errors, f"{label}: {len(batch) - written} IPs já existiam e foram ignorados.")
+                job.processed_rows += row_count
+                job.heartbeat_at = _utc_now()
+                db.commit()  # o lote e o progresso do job são gravados juntos
+            except SQLAlchemyError as e:
+                db.rollback()
+                _add_error(job, errors, f"{label}: {getattr(e, 'orig', e)}")
+                job.processed_rows += row_count
+                db.commit()
+
+        job.status = "finished"
+        job.finished_at = _utc_now()
+        db.commit()
+        logging.info(f"Importação {job_id} concluída: {job.created_rows} nós adicionados, {job.updated_rows} atualizados, {len(errors)} erros.")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Importação {job_id} falhou: {e}")
+        job = db.get(ImportJob, job_id)
+        if job is not None:
+            _add_error(job, errors, f"Erro inesperado: {e}")
+            job.status = "failed"
+            job.finished_at = _utc_now()
+            db.commit()
+    finally:
+        db.close()
+    return pending_locations
+
+def run_import_job(job_id: str, nodes_to_create: List[dict], nodes_to_update: List[dict]):
+    if _run_job(job_id, lambda db: _list_chunks(nodes_to_create, nodes_to_update)):
+        # Só depois de o job terminar: a geolocalização remota pode demorar e não deve atrasar o estado final
+        fill_pending_locations()
+
+def run_staged_import_job(job_id: str, overwrite_duplicates: bool, skip_ips: Set[str]):
+    pending_locations = _run_job(job_id, lambda db: _staged_chunks(db, job_id, overwrite_duplicates, skip_ips))
+    db = SessionLocal()
+    try:
+        db.query(ImportRow).filter(ImportRow.job_id == job_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+    if pending_locations:
+        fill_pending_locations()
+
+# --- Análise do CSV --- #
+def _row_data(row: ImportRow) -> dict:
+    return {field: getattr(row, field) for field in NODE_IMPORT_FIELDS}
+
+def _open_csv(binary_file) -> csv.DictReader:
+    """Descodifica o upload de forma incremental; o ficheiro nunca é lido inteiro para a memória."""
+    # codecs em vez de io.TextIOWrapper: o SpooledTemporaryFile do UploadFile só expõe read/seek no Python 3.9
+    stream = codecs.getreader("utf-8-sig")(binary_file)
+    try:
+        dialect = csv.Sniffer().sniff(stream.readline(), delimiters=',;')
+    except csv.Error:
+        dialect = 'excel'
+    stream.seek(0)
+    reader = csv.DictReader(stream, dialect=dialect)
+    if reader.fieldnames:
+        reader.fieldnames = [field.strip() for field in reader.fieldnames]
+    missing = REQUIRED_CSV_COLUMNS - set(reader.fieldnames or [])
+    if missing:
+        raise CsvImportError(f"Colunas em falta no CSV: {', '.join(missing)}")
+    return reader
+
+def _parse_row(row: dict) -> dict:
+    cleaned_row = {key.strip() if key else key: value.strip() if isinstance(value, str) else value for key, value in row.items()}
+    network = cleaned_row.get('network')
+    secondary_ip = cleaned_row.get('secondary_ip')
+    return {
+        "name": cleaned_row.get('name'), "ip_address": cleaned_row.get('ip_address'),
+        "wallet_address": cleaned_row.get('wallet_address'), "vps_provider": cleaned_row.get('vps_provider'),
+        "network": network.lower() if network else network, "secondary_ip": None if secondary_ip == '0' else secondary_ip,
+    }
+
+def analyze_csv_upload(db: Session, binary_file, schema) -> ImportJob:
+    """
+    Valida o CSV linha a linha e guarda as linhas válidas em import_rows, em
+    lotes, associadas a um job no estado "analyzed". Só as contagens e os
+    primeiros erros ficam no job; o resto é consultado por páginas.
+    """
+    try:
+        reader = _open_csv(binary_file)
+    except UnicodeDecodeError:
+        raise CsvImportError("Não foi possível descodificar o ficheiro. Verifique se está em formato UTF-8.")
+    existing_ips = {ip for (ip,) in db.query(Node.ip_address)}
+    job = ImportJob(id=uuid.uuid4().hex, status="analyzed", errors="[]", created_at=_utc_now())
+    db.add(job)
+    db.flush()
+
+    errors, buffer = [], []
+    insert_rows = ImportRow.__table__.insert()
+    try:
+        for line_num, row in enumerate(reader, start=2):
+            try:
+                node_data = _parse_row(row)
+                if not node_data['ip_address']:
+                    raise CsvImportError("ip_address em falta.")
+                node_data = schema(**node_data).dict()
+            except CsvImportError as e:
+                job.invalid_rows += 1
+                _add_error(job, errors, f"Linha {line_num}: {e}", log=False)
+                continue
+            except ValidationError as e:
+                job.invalid_rows += 1
+                _add_error(job, errors, f"Linha {line_num}: Erro de validação - {e}", log=False)
+                continue
+
+            if node_data['ip_address'] in existing_ips:
+                kind = "duplicate"
+                job.duplicate_rows += 1
+            else:
+                kind = "new"
+                job.new_rows += 1
+                existing_ips.add(node_data['ip_address'])
+            buffer.append({**node_data, 'job_id': job.id, 'line': line_num, 'kind': kind})
+            if len(buffer) >= IMPORT_BATCH_SIZE:
+                db.execute(insert_rows, buffer)
+                buffer = []
+        if buffer:
+            db.execute(insert_rows, buffer)
+    except UnicodeDecodeError:
+        db.rollback()
+        raise CsvImportError("Não foi possível descodificar o ficheiro. Verifique se está em formato UTF-8.")
+    except csv.Error as e:
+        db.rollback()
+        raise CsvImportError(f"CSV inválido na linha {reader.line_num}: {e}")
+    job.total_rows = job.new_rows + job.duplicate_rows
+    db.commit()
+    logging.info(f"CSV analisado (importação {job.id}): {job.new_rows} novos, {job.duplicate_rows} duplicados, {job.invalid_rows} inválidos.")
+    return job
+
+def import_preview(db: Session, job_id: str, kind: str, offset: int, limit: int) -> List[dict]:
+    rows = db.query(ImportRow).filter(ImportRow.job_id == job_id, ImportRow.kind == kind).order_by(ImportRow.id).offset(offset).limit(limit)
+    return [{"line": row.line, **_row_data(row)} for row in rows]
+
+def submit_staged_import(db: Session, job_id: str, overwrite_duplicates: bool, skip_ips: Set[str]) -> ImportJob:
+    """Confirma uma importação analisada e entrega-a ao executor. Uma análise só pode ser importada uma vez."""
+    claimed = db.query(ImportJob).filter(ImportJob.id == job_id, ImportJob.status == "analyzed").update(
+        {"status": "queued", "owner": _PROCESS_ID, "heartbeat_at": _utc_now()}, synchronize_session=False,
+    )
+    db.commit()
+    if not claimed:
+        raise CsvImportError("Esta análise não existe, expirou ou já foi importada.")
+    job = db.get(ImportJob, job_id)
+    job.total_rows = job.new_rows + (job.duplicate_rows if overwrite_duplicates else 0)
+    db.commit()
+    _get_executor().submit(run_staged_import_job, job_id, overwrite_duplicates, skip_ips)
+    return job
+
+def heartbeat_import_jobs():
+    """
+    Periódica: renova o sinal de vida dos jobs em fila ou em curso deste
+    processo e marca como falhados os de processos que pararam (sem sinal há
+    mais de IMPORT_HEARTBEAT_TTL segundos), que nenhuma thread vai retomar.
+    Os jobs de outros processos da API ainda vivos não são tocados.
+    """
+    db = SessionLocal()
+    try:
+        now = _utc_now()
+        active = ImportJob.status.in_(("queued", "running"))
+        db.query(ImportJob).filter(active, ImportJob.owner == _PROCESS_ID).update(
+            {ImportJob.heartbeat_at: now}, synchronize_session=False)
+        # Jobs anteriores à coluna heartbeat_at contam a partir da criação
+        stale_before = now - timedelta(seconds=IMPORT_HEARTBEAT_TTL)
+        stale = db.query(ImportJob).filter(active, func.coalesce(ImportJob.heartbeat_at, ImportJob.created_at) < stale_before).all()
+        for job in stale:
+            _add_error(job, json.loads(job.errors), "Importação interrompida: o processo da API que a executava parou. Volte a submeter o ficheiro.", log=False)
+            job.status = "failed"
+            job.finished_at = now
+        db.commit()
+        if stale:
+            logging.warning(f"{len(stale)} importações de processos da API que pararam marcadas como falhadas.")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Falha ao renovar os jobs de importação: {e}")
+    finally:
+        db.close()
+
+def purge_expired_imports():
+    """Apaga análises nunca confirmadas, as linhas que sobraram de importações terminadas e os jobs antigos."""
+    db = SessionLocal()
+    try:
+        now = _utc_now()
+        cutoff = now - timedelta(hours=IMPORT_ANALYSIS_TTL_HOURS)
+        retention_cutoff = now - timedelta(days=IMPORT_JOB_RETENTION_DAYS)
+        # As linhas saem com a mais curta das duas retenções, para não ficarem órfãs dos jobs apagados
+        expired = db.query(ImportJob.id).filter(
+            ImportJob.created_at < max(cutoff, retention_cutoff), ImportJob.status.in_(("analyzed", "finished", "failed"))
+        )
+        deleted = db.query(ImportRow).filter(ImportRow.job_id.in_(expired.scalar_subquery())).delete(synchronize_session=False)
+        db.query(ImportJob).filter(ImportJob.created_at < cutoff, ImportJob.status == "analyzed").delete(synchronize_session=False)
+        jobs = db.query(ImportJob).filter(
+            ImportJob.created_at < retention_cutoff, ImportJob.status.in_(("finished", "failed"))
+        ).delete(synchronize_session=False)
+        db.commit()
+        if deleted or jobs:
+            logging.info(f"Importações expiradas removidas: {deleted} linhas em espera, {jobs} jobs terminados.")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Falha ao limpar importações expiradas: {e}")
+    finally:
+        db.close()
+
+def import_job_status(job: ImportJob) -> dict:
+    elapsed = ((job.finished_at or _utc_now()) - job.started_at).total_seconds() if job.started_at else 0
+    status = {
+        "id": job.id,
+        "status": job.status,
+        "total_rows": job.total_rows,
+        "processed_rows": job.processed_rows,
+        "created_rows": job.created_rows,
+        "updated_rows": job.updated_rows,
+        "errors": json.loads(job.errors),
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "rows_per_second": round(job.processed_rows / elapsed, 1) if elapsed > 0 else None,
+    }
+    if job.status == "finished":
+        status["message"] = f"{job.created_rows} nós adicionados, {job.updated_rows} nós atualizados com sucesso."
+    return status
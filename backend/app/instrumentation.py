@@ -0,0 +1,84 @@
+import os
+import time
+from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+load_dotenv()
+
+# --- Configurações --- #
+# O poller corre noutro processo: cada worker expõe as suas métricas em POLLER_METRICS_PORT + índice (0 desliga)
+POLLER_METRICS_PORT = int(os.getenv("POLLER_METRICS_PORT", 9108))
+
+_FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# --- Métricas --- #
+SWEEP_DURATION = Histogram(
+    "nodemon_sweep_duration_seconds", "Duração de uma varredura completa (update_all_nodes_status).",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200),
+)
+PROBE_DURATION = Histogram(
+    "nodemon_probe_duration_seconds", "Duração de cada tentativa de verificação de um nó, por rede.",
+    ["network"], buckets=_FAST_BUCKETS,
+)
+PROBE_WAIT = Histogram(
+    "nodemon_probe_wait_seconds", "Espera pelo ritmo (fornecedor/sub-rede) e pelas vagas (semáforos) antes de cada tentativa.",
+    ["network"], buckets=_FAST_BUCKETS,
+)
+PROBE_RESULTS = Counter(
+    "nodemon_probes_total", "Verificações concluídas, por rede e resultado (online ou a classe da falha: timeout, refused, unreachable, http_error, ...).",
+    ["network", "outcome"],
+)
+CONNECT_RESULTS = Counter(
+    "nodemon_connect_results_total", "Ligações de verificação por resultado (open, refused, timeout, unreachable, error).",
+    ["result"],
+)
+DB_WRITE_DURATION = Histogram(
+    "nodemon_db_write_seconds", "Duração das gravações em lote na base de dados.",
+    ["operation"], buckets=_FAST_BUCKETS,
+)
+ALERT_QUEUE_DEPTH = Gauge("nodemon_alert_queue_depth", "Alertas à espera de envio neste processo.")
+ALERT_EMAILS = Counter("nodemon_alert_emails_total", "Emails de alerta, por resultado (sent, failed, skipped).", ["result"])
+EXTERNAL_REQUESTS = Counter(
+    "nodemon_external_requests_total", "Pedidos a APIs externas, por serviço e resultado (ok, error).",
+    ["service", "result"],
+)
+SSH_SESSIONS = Gauge("nodemon_ssh_sessions_active", "Sessões SSH interativas abertas.")
+HTTP_REQUEST_DURATION = Histogram(
+    "nodemon_http_request_duration_seconds", "Latência dos endpoints da API, por rota (modelo do caminho) e código.",
+    ["method", "route", "status"], buckets=_FAST_BUCKETS,
+)
+
+def metrics_payload() -> tuple:
+    """(corpo, content-type) no formato de texto do Prometheus."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+class RequestMetricsMiddleware:
+    """
+    Middleware ASGI simples (sem BaseHTTPMiddleware, que acrescenta uma tarefa
+    e filas por pedido). A rota é o modelo do caminho (ex.: /nodes/{node_id}),
+    para que IDs não criem uma série por valor.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], route.path if route is not None else "unmatched", str(status_code),
+            ).observe(time.perf_counter() - start)
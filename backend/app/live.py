@@ -0,0 +1,175 @@
+import os
+import asyncio
+import logging
+from typing import Optional
+from dotenv import load_dotenv
+from fastapi.encoders import jsonable_encoder
+from .database import SessionLocal
+from .models import Node
+from .changes import current_node_version, node_change_events
+
+load_dotenv()
+
+# --- Configurações --- #
+LIVE_POLL_INTERVAL = float(os.getenv("LIVE_POLL_INTERVAL", 2))  # segundos entre leituras de alterações na base de dados
+LIVE_COALESCE_WINDOW = float(os.getenv("LIVE_COALESCE_WINDOW", 1))  # intervalo mínimo entre mensagens para o mesmo painel
+LIVE_KEEPALIVE_INTERVAL = float(os.getenv("LIVE_KEEPALIVE_INTERVAL", 30))
+
+NODE_COLUMNS = [column.name for column in Node.__table__.columns]
+
+def node_payload(node: Node) -> dict:
+    return jsonable_encoder({column: getattr(node, column) for column in NODE_COLUMNS})
+
+class LiveSubscriber:
+    """
+    Um painel ligado a /ws/nodes. As alterações recebidas ficam num dicionário
+    por nó até serem enviadas, por isso rajadas (ou um cliente lento) resultam
+    numa única mensagem com o estado mais recente de cada nó.
+    """
+
+    def __init__(self, network: Optional[str] = None):
+        self.network = network
+        self.version = None  # versão do snapshot enviado; None até o snapshot estar pronto
+        self.node_ids = set()
+        self._pending = {}
+        self._latest = 0
+        self._wake = asyncio.Event()
+
+    def push(self, version: int, events: list):
+        for row_version, node_id, network, payload in events:
+            if self.network and network != self.network:
+                if node_id not in self.node_ids:
+                    continue
+                payload = None  # o nó passou para outra rede: para este painel é uma remoção
+            self._pending[node_id] = (row_version, payload)
+        self._latest = max(self._latest, version)
+        if self._pending:
+            self._wake.set()
+
+    def set_snapshot(self, version: int, node_ids: set):
+        self.version = version
+        self.node_ids = node_ids
+        self._latest = max(self._latest, version)
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def take(self) -> Optional[dict]:
+        """Monta a próxima mensagem de alterações, descartando o que o snapshot já incluía."""
+        self._wake.clear()
+        changed, deleted = [], []
+        for node_id, (row_version, payload) in self._pending.items():
+            if row_version <= self.version:
+                continue
+            if payload is None:
+                if node_id in self.node_ids:
+                    deleted.append(node_id)
+                    self.node_ids.discard(node_id)
+            else:
+                changed.append(payload)
+                self.node_ids.add(node_id)
+        self._pending.clear()
+        self.version = self._latest
+        if not changed and not deleted:
+            return None
+        return {"type": "changes", "version": self.version, "changed": changed, "deleted": deleted}
+
+class NodeChangeBroadcaster:
+    """
+    Lê as alterações da tabela nodes (pela versão de linha) a cada
+    LIVE_POLL_INTERVAL segundos e distribui-as pelos painéis ligados. O poller
+    corre noutro processo, por isso a base de dados é a fonte das transições;
+    uma única leitura por API serve todos os painéis, e sem painéis não há leitura.
+    """
+
+    def __init__(self, interval: float = LIVE_POLL_INTERVAL):
+        self.interval = interval
+        self._subscribers = set()
+        self._version = None
+        self._task = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def subscribe(self, network: Optional[str] = None) -> tuple:
+        """Regista o painel e devolve (subscritor, snapshot). Alterações posteriores ao snapshot chegam por push()."""
+        subscriber = LiveSubscriber(network)
+        # Regista antes de ler o snapshot: nada do que acontecer entretanto se perde, e o que for repetido é descartado em take()
+        self._subscribers.add(subscriber)
+        try:
+            version, nodes = await asyncio.get_running_loop().run_in_executor(None, self._read_snapshot, network)
+        except Exception:
+            self._subscribers.discard(subscriber)
+            raise
+        subscriber.set_snapshot(version, {node["id"] for node in nodes})
+        return subscriber, {"type": "snapshot", "version": version, "network": network, "nodes": nodes}
+
+    def unsubscribe(self, subscriber: LiveSubscriber):
+        self._subscribers.discard(subscriber)
+
+    @staticmethod
+    def _read_snapshot(network: Optional[str]) -> tuple:
+        db = SessionLocal()
+        try:
+            version = current_node_version(db)
+            query = db.query(Node)
+            if network:
+                query = query.filter(Node.network == network)
+            return version, [node_payload(node) for node in query.order_by(Node.id)]
+        finally:
+            db.close()
+
+    @staticmethod
+    def _read_events(since: int) -> tuple:
+        db = SessionLocal()
+        try:
+            version, events = node_change_events(db, since)
+            return version, [
+                (row_version, node_id, network, node_payload(node) if node is not None else None)
+                for row_version, node_id, network, node in events
+            ]
+        finally:
+            db.close()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self._subscribers:
+                self._version = None
+                continue
+            if self._version is None:
+                # Retoma a partir do snapshot mais antigo assim que todos os painéis tiverem o seu
+                versions = [subscriber.version for subscriber in self._subscribers]
+                if None in versions:
+                    continue
+                self._version = min(versions)
+            try:
+                version, events = await loop.run_in_executor(None, self._read_events, self._version)
+            except Exception as e:
+                logging.error(f"Erro ao ler alterações dos nós para os painéis ligados: {e}")
+                continue
+            if events:
+                for subscriber in list(self._subscribers):
+                    subscriber.push(version, events)
+            self._version = version
+
+node_broadcaster = NodeChangeBroadcaster()
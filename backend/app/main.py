@@ -1,268 +1,112 @@
-from fastapi import FastAPI, Depends, HTTPException, status, File, UploadFile, WebSocket
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, status, File, UploadFile, WebSocket, Query, Response, Request, Header
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from starlette.websockets import WebSocketDisconnect
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, ValidationError
+from sqlalchemy import and_, or_, select
+from pydantic import BaseModel
 from typing import Optional, List
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.exc import OperationalError
 import secrets
 import os
-import requests
-import csv
-import io
-import time
 import logging
 import asyncio
-import aiohttp
-import smtplib
-import paramiko
 import socket
 import json
-from . import ssh_manager
-from email.mime.text import MIMEText
+import base64
+import zlib
+from .database import DB_CONNECT_BACKOFF_MAX, dispose_async_engine, get_async_db, get_db, ping_database, prepare_database
+from .models import ImportJob, Node, NodeMetrics, PollerControl, PollerWorker
+from .alerts import alert_dispatcher
+from .changes import current_node_version, next_node_version, node_changes_since, record_node_deletions
+from .geolocation import GEO_FILL_INTERVAL, LOCATION_PENDING, fill_pending_locations, resolve_locations
+from .imports import (
+    IMPORT_HEARTBEAT_INTERVAL, CsvImportError, analyze_csv_upload, heartbeat_import_jobs, import_job_status,
+    import_preview, purge_expired_imports, shutdown_import_executor, submit_import_job, submit_staged_import,
+)
+from .network_status import GLOBAL_STATUS_FETCHERS, global_status_cache
+from .live import LIVE_COALESCE_WINDOW, LIVE_KEEPALIVE_INTERVAL, node_broadcaster
+from .history import HISTORY_MAINTENANCE_INTERVAL, HISTORY_RESOLUTIONS, query_history, run_history_maintenance
+from .poller import (
+    POLL_MODE, POLL_RELOAD_INTERVAL, POLL_SWEEP_INTERVAL, adaptive_scheduler, close_http_session,
+    get_http_session, request_poller_refresh, update_all_nodes_status,
+)
+from .instrumentation import SSH_SESSIONS, RequestMetricsMiddleware, metrics_payload
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 
 # --- Configurações --- #
-DATABASE_URL = os.getenv("DATABASE_URL")
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "Luftcia125@@")
-SMTP_SERVER = os.getenv("SMTP_SERVER")
-SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
-SMTP_USER = os.getenv("SMTP_USER")
-SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-RECIPIENT_EMAIL = os.getenv("RECIPIENT_EMAIL")
-
-# --- Base de Dados --- #
-Base = declarative_base()
-engine = None
-MAX_RETRIES = 5
-RETRY_DELAY = 5
-
-for i in range(MAX_RETRIES):
-    try:
-        engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-        Base.metadata.create_all(bind=engine)
-        logging.info("Conexão com a base de dados estabelecida com sucesso.")
-        break  # Se a conexão for bem-sucedida, sai do loop
-    except OperationalError as e:
-        logging.error(f"Tentativa {i+1}/{MAX_RETRIES} falhou ao conectar na base de dados: {e}")
-        if i < MAX_RETRIES - 1:
-            logging.info(f"Aguardando {RETRY_DELAY} segundos para a próxima tentativa...")
-            time.sleep(RETRY_DELAY)
-        else:
-            logging.error("Não foi possível conectar à base de dados após várias tentativas.")
-            raise
-
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-# --- Modelos da Base de Dados --- #
-class Node(Base):
-    __tablename__ = "nodes"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
-    ip_address = Column(String, unique=True, index=True)
-    secondary_ip = Column(String, nullable=True)
-    vps_provider = Column(String)
-    wallet_address = Column(String, index=True)
-    location = Column(String, default="A ser verificado")
-    network = Column(String, index=True)
-    status = Column(String, default="Aguardando verificação")
-    currentBlock = Column(Integer, default=0)
-    lastUpdate = Column(DateTime, default=datetime.now(timezone.utc))
-
-# --- Funções de Lógica de Negócio --- #
-def get_locations_for_ips_batch(ips: List[str]) -> dict:
-    locations = {}
-    if not ips:
-        return locations
-    try:
-        # ip-api.com allows up to 100 IPs per batch request
-        response = requests.post("http://ip-api.com/batch", json=ips, timeout=15)
-        response.raise_for_status()
-        data = response.json()
-        for item in data:
-            query = item.get('query')
-            if item.get('status') == 'success':
-                city = item.get('city', '')
-                country = item.get('country', '')
-                locations[query] = f"{city}, {country}"
-            else:
-                locations[query] = "Localização não encontrada"
-    except requests.RequestException as e:
-        logging.error(f"Erro ao buscar geolocalização em lote: {e}")
-        # On batch failure, mark all as not found
-        for ip in ips:
-            locations[ip] = "Localização não encontrada"
-    return locations
-
-def send_email_alert(node_name: str, ip_address: str):
-    if not all([SMTP_SERVER, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, RECIPIENT_EMAIL]):
-        logging.warning("Configurações de SMTP não encontradas. Pulando o envio de email.")
-        return
-
-    subject = f"Alerta: Nó {node_name} está Offline"
-    body = f"O nó {node_name} com o endereço IP {ip_address} foi detectado como offline. Por favor, verifique."
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = SMTP_USER
-    msg['To'] = RECIPIENT_EMAIL
 
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASSWORD)
-            server.send_message(msg)
-            logging.info(f"Email de alerta enviado para {RECIPIENT_EMAIL} sobre o nó {node_name}.")
-    except Exception as e:
-        logging.error(f"Falha ao enviar email de alerta: {e}")
+# --- Configuração do Scheduler e Lifespan --- #
+scheduler = AsyncIOScheduler()
 
-async def check_single_node(session: aiohttp.ClientSession, node: Node, semaphore: asyncio.Semaphore):
-    async with semaphore:
-        ip = node.ip_address
-        # Default to the last known status, to avoid flapping
-        new_status = {'status': node.status, 'currentBlock': node.currentBlock}
-        is_online = False
+# Estado do arranque, exposto em /readyz: "starting", "ready" ou "failed"
+startup_state = {"status": "starting", "error": None}
 
+async def start_database_services():
+    """
+    Segunda fase do arranque, em segundo plano: a API já responde (/healthz)
+    enquanto espera pela base de dados e aplica o esquema. Só depois arrancam
+    os jobs e serviços que a usam, e /readyz passa a 200.
+    """
+    while True:
         try:
-            if node.network == 'nkn':
-                try:
-                    # 1. Quick TCP check
-                    conn = asyncio.open_connection(ip, 30003)
-                    _, writer = await asyncio.wait_for(conn, timeout=5)
-                    writer.close()
-                    await writer.wait_closed()
-                    is_online = True
-                    new_status['status'] = 'Online' # Tentative status
-                except (asyncio.TimeoutError, ConnectionRefusedError):
-                    is_online = False
-
-                # 2. If TCP check passes, try to get detailed status
-                if is_online:
-                    try:
-                        payload = {"jsonrpc": "2.0", "method": "getnodestate", "params": {}, "id": 1}
-                        async with session.post(f"http://{ip}:30003", json=payload, timeout=5) as response:
-                            response.raise_for_status()
-                            data = await response.json()
-                            result = data.get('result', {})
-                            new_status['status'] = result.get('syncState', 'Online') # Fallback to Online
-                            new_status['currentBlock'] = result.get('height', 0)
-                    except (aiohttp.ClientError, asyncio.TimeoutError):
-                        # API call failed, but we know the port is open, so we keep it as 'Online'
-                        pass
-
-            elif node.network == 'sentinel':
-                # For Sentinel, check a few common ports. If any is open, consider it online.
-                ports_to_check = [443, 80, 8553, 2624]
-                for port in ports_to_check:
-                    try:
-                        conn = asyncio.open_connection(ip, port)
-                        _, writer = await asyncio.wait_for(conn, timeout=3)
-                        writer.close()
-                        await writer.wait_closed()
-                        is_online = True
-                        new_status['status'] = 'Online'
-                        break # Exit loop if a port is found open
-                    except (asyncio.TimeoutError, ConnectionRefusedError):
-                        continue # Try next port
-            
-            elif node.network == 'mysterium':
-                try:
-                    async with session.get(f"http://{ip}:4050/healthcheck", timeout=5) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            if data.get('status') == 'UP':
-                                is_online = True
-                                new_status['status'] = 'Online'
-                except (aiohttp.ClientError, asyncio.TimeoutError):
-                    # If healthcheck fails, try a simple TCP check as a fallback
-                    try:
-                        conn = asyncio.open_connection(ip, 4050)
-                        _, writer = await asyncio.wait_for(conn, timeout=3)
-                        writer.close()
-                        await writer.wait_closed()
-                        is_online = True
-                        new_status['status'] = 'Online'
-                    except (asyncio.TimeoutError, ConnectionRefusedError):
-                        pass
-
-            else: # Generic check for other networks
-                try:
-                    conn = asyncio.open_connection(ip, 443)
-                    _, writer = await asyncio.wait_for(conn, timeout=5)
-                    writer.close()
-                    await writer.wait_closed()
-                    is_online = True
-                    new_status['status'] = 'Online'
-                except (asyncio.TimeoutError, ConnectionRefusedError):
-                    pass
-
-            if not is_online:
-                new_status['status'] = 'Offline'
-
+            await prepare_database()
+            break
         except Exception as e:
-            logging.error(f"Erro inesperado ao verificar o nó {node.name} ({ip}): {e}")
-            new_status['status'] = 'Offline' # Mark as offline on unexpected errors
-
-        return node.id, new_status
-
-async def update_all_nodes_status():
-    db = SessionLocal()
-    try:
-        logging.info("Iniciando a tarefa de atualização de status dos nós...")
-        
-        all_nodes = db.query(Node).all()
-        total_nodes = len(all_nodes)
-        
-        if total_nodes == 0:
-            logging.info("Nenhum nó para atualizar.")
-            return
-
-        semaphore = asyncio.Semaphore(100) # Limita a 100 verificações concorrentes
-        
-        async with aiohttp.ClientSession() as session:
-            tasks = [check_single_node(session, node, semaphore) for node in all_nodes]
-            results = await asyncio.gather(*tasks)
-
-        updated_count = 0
-        for node_id, new_status in results:
-            node = db.query(Node).filter(Node.id == node_id).first()
-            if node:
-                if new_status['status'] == 'Offline' and node.status != 'Offline':
-                    send_email_alert(node.name, node.ip_address)
-                
-                node.status = new_status['status']
-                node.currentBlock = new_status['currentBlock']
-                node.lastUpdate = datetime.now(timezone.utc)
-                updated_count += 1
-
-        db.commit()
-        logging.info(f"Tarefa de atualização de status concluída. {updated_count}/{total_nodes} nós atualizados.")
-    finally:
-        db.close()
-
-# --- Configuração do Scheduler e Lifespan --- #
-scheduler = AsyncIOScheduler()
+            # Sem base de dados a API continua viva (/readyz responde 503) e volta a tentar
+            startup_state.update(status="failed", error=str(e))
+            logging.error(f"Base de dados indisponível no arranque: {e}. Nova série de tentativas em {DB_CONNECT_BACKOFF_MAX:g} segundos.")
+            await asyncio.sleep(DB_CONNECT_BACKOFF_MAX)
+    if POLL_MODE == "sweep":
+        scheduler.add_job(update_all_nodes_status, 'interval', seconds=POLL_SWEEP_INTERVAL, id="update_nodes")
+    elif POLL_MODE == "adaptive":
+        scheduler.add_job(adaptive_scheduler.reload_nodes, 'interval', seconds=POLL_RELOAD_INTERVAL, id="reload_poll_queue")
+        adaptive_scheduler.start()
+    if POLL_MODE in ("sweep", "adaptive"):
+        alert_dispatcher.start()
+        scheduler.add_job(run_history_maintenance, 'interval', seconds=HISTORY_MAINTENANCE_INTERVAL, id="history_maintenance")
+    # Retoma geolocalizações que ficaram pendentes (API remota indisponível, reinício a meio de uma importação)
+    scheduler.add_job(fill_pending_locations, 'interval', seconds=GEO_FILL_INTERVAL, id="fill_pending_locations")
+    scheduler.add_job(purge_expired_imports, 'interval', hours=1, id="purge_expired_imports")
+    # Sinal de vida dos jobs de importação deste processo; os de processos que pararam passam a falhados
+    scheduler.add_job(heartbeat_import_jobs, 'interval', seconds=IMPORT_HEARTBEAT_INTERVAL, id="heartbeat_import_jobs")
+    scheduler.start()
+    node_broadcaster.start()
+    startup_state.update(status="ready", error=None)
+    logging.info("Base de dados pronta; serviços em segundo plano iniciados.")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("🚀 A iniciar a aplicação...")
-    scheduler.add_job(update_all_nodes_status, 'interval', minutes=10, id="update_nodes")
-    scheduler.start()
+    global_status_cache.start(get_http_session)
+    startup_task = asyncio.create_task(start_database_services())
     yield
     print("👋 A encerrar a aplicação...")
-    scheduler.shutdown()
+    startup_task.cancel()
+    await asyncio.gather(startup_task, return_exceptions=True)
+    if scheduler.running:
+        scheduler.shutdown()
+    await node_broadcaster.stop()
+    await global_status_cache.stop()
+    await adaptive_scheduler.stop()
+    await alert_dispatcher.stop()
+    await close_http_session()
+    await dispose_async_engine()
+    shutdown_import_executor()
 
 # --- Aplicação FastAPI --- #
 app = FastAPI(title="NodeMon API", description="API para o Sistema de Monitoramento de Nós", lifespan=lifespan)
+app.add_middleware(RequestMetricsMiddleware)
 
 # --- Segurança e Dependências --- #
 security = HTTPBasic()
@@ -292,13 +136,6 @@ def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
     logging.info("====================================")
     return credentials.username
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # --- Esquemas Pydantic --- #
 class NodeBase(BaseModel):
     name: str
@@ -320,67 +157,244 @@ class NodeSchema(NodeBase):
     status: Optional[str] = None
     currentBlock: Optional[int] = None
     lastUpdate: Optional[datetime] = None
+    row_version: Optional[int] = None
     class Config:
         from_attributes = True
 
+class NodeMetricsSchema(BaseModel):
+    node_id: int
+    neighbor_count: Optional[int] = None
+    relay_message_count: Optional[int] = None
+    uptime: Optional[int] = None
+    version: Optional[str] = None
+    proposal_submitted: Optional[int] = None
+    connect_ms: Optional[int] = None
+    rpc_ms: Optional[int] = None
+    rtt_ms: Optional[int] = None
+    failure: Optional[str] = None
+    updated_at: datetime
+    class Config:
+        from_attributes = True
+
+class SlowNodeSchema(BaseModel):
+    id: int
+    name: str
+    ip_address: str
+    vps_provider: str
+    network: str
+    status: Optional[str] = None
+    connect_ms: Optional[int] = None
+    rpc_ms: Optional[int] = None
+    rtt_ms: int
+    failure: Optional[str] = None
+    updated_at: datetime
+
+class NodeChanges(BaseModel):
+    version: int
+    changed: List[NodeSchema]
+    deleted: List[int]
+
+class NodeImportPreviewRow(NodeBase):
+    line: int
+
 class NodeImportAnalysis(BaseModel):
-    new_nodes: List[NodeBase]
-    duplicate_nodes: List[NodeBase]
+    import_id: str
+    new_count: int
+    duplicate_count: int
+    error_count: int
     errors: List[str]
+    # Só a primeira página de cada tipo; as seguintes vêm de /nodes/upload-csv/{import_id}/rows
+    new_nodes: List[NodeImportPreviewRow]
+    duplicate_nodes: List[NodeImportPreviewRow]
+
+class StagedImportRequest(BaseModel):
+    overwrite_duplicates: bool = True
+    skip_ips: List[str] = []
 
 class NodeImportRequest(BaseModel):
     nodes_to_create: List[NodeBase]
     nodes_to_update: List[NodeBase]
 
+class ImportJobStatus(BaseModel):
+    id: str
+    status: str
+    total_rows: int
+    processed_rows: int
+    created_rows: int
+    updated_rows: int
+    errors: List[str]
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    rows_per_second: Optional[float] = None
+    message: Optional[str] = None
 
-# --- Criação das Tabelas --- #
-Base.metadata.create_all(bind=engine)
-
-async def check_and_update_node_status(node_id: int):
-    db = SessionLocal()
-    try:
-        node = db.query(Node).filter(Node.id == node_id).first()
-        if not node:
-            logging.warning(f"Verificação imediata falhou: Nó com ID {node_id} não encontrado.")
-            return
 
-        logging.info(f"Iniciando verificação de status imediata para o nó {node.name} ({node.ip_address})...")
-        async with aiohttp.ClientSession() as session:
-            semaphore = asyncio.Semaphore(1) # Semaphore for a single check
-            _, new_status = await check_single_node(session, node, semaphore)
-
-        # Fetch the node again in the session to update it
-        node_to_update = db.query(Node).filter(Node.id == node_id).first()
-        if node_to_update:
-            node_to_update.status = new_status['status']
-            node_to_update.currentBlock = new_status['currentBlock']
-            node_to_update.lastUpdate = datetime.now(timezone.utc)
-            db.commit()
-            logging.info(f"Status imediato atualizado para o nó {node.name} ({node.ip_address}): {new_status['status']}")
-        else:
-            logging.error(f"Não foi possível atualizar o status para o nó com ID {node_id} porque ele não foi encontrado após a verificação.")
+# --- Endpoints da API --- #
+NODE_FIELDS = [column.name for column in Node.__table__.columns]
+NODE_SORT_KEYS = {key: getattr(Node, key) for key in ("id", "name", "ip_address", "status", "currentBlock", "lastUpdate", "vps_provider", "location")}
+NODES_MAX_PAGE_SIZE = 1000
+IMPORT_PREVIEW_PAGE_SIZE = 50
 
-    except Exception as e:
-        logging.error(f"Erro durante a verificação de status imediata para o nó ID {node_id}: {e}")
-    finally:
-        db.close()
+def _encode_cursor(sort_value, node_id: int) -> str:
+    raw = json.dumps([sort_value.isoformat() if isinstance(sort_value, datetime) else sort_value, node_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
+def _decode_cursor(cursor: str, sort: str):
+    try:
+        sort_value, node_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort == "lastUpdate" and sort_value is not None:
+            sort_value = datetime.fromisoformat(sort_value)
+        return sort_value, int(node_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido.")
+
+def _nodes_etag(version: int, query: str) -> str:
+    return f'W/"{version}-{zlib.crc32(query.encode()):08x}"'
+
+@app.get("/nodes/changes", response_model=NodeChanges, dependencies=[Depends(get_current_username)])
+def read_node_changes(since: int = Query(0, ge=0), network: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    Nós alterados e apagados desde a versão `since`. O cliente guarda o campo
+    `version` da resposta e usa-o como `since` na consulta seguinte.
+    """
+    return node_changes_since(db, since, network)
+
+@app.get("/nodes/slowest", response_model=List[SlowNodeSchema], dependencies=[Depends(get_current_username)])
+async def read_slowest_nodes(network: Optional[str] = None, limit: int = Query(20, ge=1, le=NODES_MAX_PAGE_SIZE), db: AsyncSession = Depends(get_async_db)):
+    """Nós online com a maior latência medida na última verificação (rtt_ms: RPC, ou ligação TCP nas sondas só de TCP)."""
+    query = select(
+        Node.id, Node.name, Node.ip_address, Node.vps_provider, Node.network, Node.status,
+        NodeMetrics.connect_ms, NodeMetrics.rpc_ms, NodeMetrics.rtt_ms, NodeMetrics.failure, NodeMetrics.updated_at,
+    ).join(NodeMetrics, NodeMetrics.node_id == Node.id).where(NodeMetrics.rtt_ms.isnot(None), Node.status != 'Offline')
+    if network:
+        query = query.where(Node.network == network)
+    result = await db.execute(query.order_by(NodeMetrics.rtt_ms.desc()).limit(limit))
+    return [row._asdict() for row in result]
 
-# --- Endpoints da API --- #
 @app.get("/nodes/", response_model=List[NodeSchema], dependencies=[Depends(get_current_username)])
-def read_nodes(network: Optional[str] = None, db: Session = Depends(get_db)):
-    return db.query(Node).filter(Node.network == network).all() if network else db.query(Node).all()
+def read_nodes(
+    request: Request,
+    response: Response,
+    network: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    provider: Optional[str] = None,
+    location: Optional[str] = None,
+    wallet: Optional[str] = None,
+    sort: str = "id",
+    order: str = "asc",
+    limit: Optional[int] = Query(None, ge=1, le=NODES_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Lista os nós. Sem `limit` devolve todos (comportamento original do dashboard);
+    com `limit`, pagina por keyset ordenado por (`sort`, id) e devolve o cursor
+    da página seguinte no cabeçalho X-Next-Cursor. `fields=id,name,status`
+    restringe as colunas devolvidas.
+    """
+    if sort not in NODE_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Ordenação inválida. Use uma de: {', '.join(NODE_SORT_KEYS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="A ordem deve ser 'asc' ou 'desc'.")
+
+    selected = None
+    if fields:
+        selected = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = set(selected) - set(NODE_FIELDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Campos desconhecidos: {', '.join(sorted(unknown))}")
+
+    # A versão global muda a cada alteração de status, cadastro ou remoção, e o lastUpdate
+    # só é gravado junto com ela: com a mesma query e a mesma versão a resposta é igual.
+    # A hora da última verificação (que muda a cada ciclo) fica fora, em /poller/status
+    etag = _nodes_etag(current_node_version(db), str(sorted(request.query_params.multi_items())))
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=dict(response.headers))
+
+    sort_column = NODE_SORT_KEYS[sort]
+    # id e a coluna de ordenação são sempre lidos, para montar o cursor
+    columns = [Node] if selected is None else [getattr(Node, field) for field in dict.fromkeys(selected + ["id", sort])]
+    query = db.query(*columns)
+
+    filters = {Node.network: network, Node.status: status_filter, Node.vps_provider: provider, Node.location: location, Node.wallet_address: wallet}
+    for column, value in filters.items():
+        if value is not None:
+            query = query.filter(column == value)
+
+    descending = order == "desc"
+    if cursor:
+        sort_value, last_id = _decode_cursor(cursor, sort)
+        if sort == "id":
+            query = query.filter(Node.id < last_id if descending else Node.id > last_id)
+        elif descending:
+            query = query.filter(or_(sort_column < sort_value, and_(sort_column == sort_value, Node.id < last_id)))
+        else:
+            query = query.filter(or_(sort_column > sort_value, and_(sort_column == sort_value, Node.id > last_id)))
+
+    if sort == "id":
+        query = query.order_by(Node.id.desc() if descending else Node.id)
+    else:
+        query = query.order_by(sort_column.desc(), Node.id.desc()) if descending else query.order_by(sort_column, Node.id)
+
+    if limit is None:
+        rows = query.all()
+    else:
+        # Lê um a mais para saber se existe página seguinte
+        rows = query.limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            response.headers["X-Next-Cursor"] = _encode_cursor(getattr(last, sort), last.id)
+
+    if selected is None:
+        return rows
+    return JSONResponse(jsonable_encoder([{field: getattr(row, field) for field in selected} for row in rows]), headers=dict(response.headers))
 
 @app.post("/nodes/", response_model=NodeSchema, status_code=status.HTTP_201_CREATED, dependencies=[Depends(get_current_username)])
-def create_node(node: NodeBase, db: Session = Depends(get_db)):
-    locations = get_locations_for_ips_batch([node.ip_address])
-    location = locations.get(node.ip_address, "Localização não encontrada")
-    db_node = Node(**node.dict(), location=location)
+def create_node(node: NodeBase, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    # Só cache e base local no pedido; o que faltar é resolvido pela API remota em segundo plano
+    location = resolve_locations(db, [node.ip_address]).get(node.ip_address, LOCATION_PENDING)
+    db_node = Node(**node.dict(), location=location, row_version=next_node_version(db))
     db.add(db_node)
     db.commit()
     db.refresh(db_node)
+    if location == LOCATION_PENDING:
+        background_tasks.add_task(fill_pending_locations, [db_node.id])
     return db_node
 
+@app.get("/nodes/{node_id}/history", dependencies=[Depends(get_current_username)])
+def read_node_history(node_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None, resolution: str = "auto", db: Session = Depends(get_db)):
+    """
+    Histórico de status de um nó. Com resolution=auto, intervalos de até 1 dia
+    vêm das amostras brutas, até 30 dias dos agregados de 5 min, e os maiores
+    dos agregados de 1 h.
+    """
+    if resolution not in HISTORY_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Resolução inválida. Use uma de: {', '.join(HISTORY_RESOLUTIONS)}")
+    if db.query(Node.id).filter(Node.id == node_id).first() is None:
+        raise HTTPException(status_code=404, detail="Nó não encontrado")
+    # Datas sem fuso são interpretadas como UTC
+    end = end.replace(tzinfo=end.tzinfo or timezone.utc) if end else datetime.now(timezone.utc)
+    start = start.replace(tzinfo=start.tzinfo or timezone.utc) if start else end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="O início do intervalo deve ser anterior ao fim.")
+    return query_history(db, node_id, start, end, resolution)
+
+@app.get("/nodes/{node_id}/metrics", response_model=NodeMetricsSchema, dependencies=[Depends(get_current_username)])
+async def read_node_metrics(node_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Tempos e falha da última verificação do nó e, nos nós NKN, vizinhos, relays, uptime e versão."""
+    if await db.scalar(select(Node.id).where(Node.id == node_id)) is None:
+        raise HTTPException(status_code=404, detail="Nó não encontrado")
+    metrics = await db.get(NodeMetrics, node_id)
+    if metrics is None:
+        raise HTTPException(status_code=404, detail="Ainda não há métricas para este nó")
+    return metrics
+
 @app.put("/nodes/{node_id}", response_model=NodeSchema, dependencies=[Depends(get_current_username)])
 def update_node(node_id: int, node_update: NodeUpdate, db: Session = Depends(get_db)):
     db_node = db.query(Node).filter(Node.id == node_id).first()
@@ -388,6 +402,7 @@ def update_node(node_id: int, node_update: NodeUpdate, db: Session = Depends(get
         raise HTTPException(status_code=404, detail="Nó não encontrado")
     for key, value in node_update.dict().items():
         setattr(db_node, key, value)
+    db_node.row_version = next_node_version(db)
     db.commit()
     db.refresh(db_node)
     return db_node
@@ -397,12 +412,16 @@ def delete_node(node_id: int, db: Session = Depends(get_db)):
     db_node = db.query(Node).filter(Node.id == node_id).first()
     if db_node is None:
         raise HTTPException(status_code=404, detail="Nó não encontrado")
+    record_node_deletions(db, [db_node])
+    db.query(NodeMetrics).filter(NodeMetrics.node_id == node_id).delete(synchronize_session=False)
     db.delete(db_node)
     db.commit()
     return
 
 @app.post("/nodes/delete-multiple", status_code=status.HTTP_200_OK, dependencies=[Depends(get_current_username)])
 def delete_multiple_nodes(node_ids: NodeIdList, db: Session = Depends(get_db)):
+    record_node_deletions(db, db.query(Node.id, Node.network).filter(Node.id.in_(node_ids.node_ids)).all())
+    db.query(NodeMetrics).filter(NodeMetrics.node_id.in_(node_ids.node_ids)).delete(synchronize_session=False)
     deleted_count = db.query(Node).filter(Node.id.in_(node_ids.node_ids)).delete(synchronize_session=False)
     db.commit()
     if deleted_count == 0:
@@ -410,177 +429,135 @@ def delete_multiple_nodes(node_ids: NodeIdList, db: Session = Depends(get_db)):
     return {"message": f"{deleted_count} nós deletados com sucesso."}
 
 @app.post("/nodes/trigger-refresh", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(get_current_username)])
-async def trigger_refresh():
+async def trigger_refresh(db: AsyncSession = Depends(get_async_db)):
+    if POLL_MODE == "adaptive":
+        adaptive_scheduler.request_full_refresh()
+        return {"message": "Atualização de status acionada."}
+    if POLL_MODE != "sweep":
+        await request_poller_refresh(db)
+        return {"message": "Atualização de status acionada."}
     job = scheduler.get_job("update_nodes")
     if job:
         scheduler.modify_job(job.id, next_run_time=datetime.now(timezone.utc))
         return {"message": "Atualização de status acionada."}
     return HTTPException(status_code=404, detail="Job de atualização não encontrado.")
 
+@app.get("/poller/status", dependencies=[Depends(get_current_username)])
+async def get_poller_status(db: AsyncSession = Depends(get_async_db)):
+    workers = (await db.execute(select(PollerWorker).order_by(PollerWorker.worker_id))).scalars().all()
+    control = await db.get(PollerControl, 1)
+    return {
+        "mode": POLL_MODE,
+        "last_poll_at": control.last_poll_at if control else None,
+        "alert_queue_depth": alert_dispatcher.queue_depth + sum(worker.alert_queue_depth or 0 for worker in workers),
+        "workers": [
+            {"worker_id": worker.worker_id, "heartbeat_at": worker.heartbeat_at, "alert_queue_depth": worker.alert_queue_depth or 0}
+            for worker in workers
+        ],
+    }
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: o processo está a servir pedidos. Não toca na base de dados."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: arranque concluído (esquema aplicado, serviços iniciados) e base de dados a responder agora."""
+    if startup_state["status"] != "ready":
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=startup_state)
+    if not await ping_database():
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "database_unavailable", "error": None})
+    return {"status": "ready"}
+
+@app.get("/metrics", dependencies=[Depends(get_current_username)])
+def read_metrics():
+    """Métricas no formato do Prometheus. As do poller (serviço à parte) estão em POLLER_METRICS_PORT de cada worker."""
+    body, content_type = metrics_payload()
+    return Response(content=body, media_type=content_type)
+
 @app.post("/nodes/upload-csv/analyze", response_model=NodeImportAnalysis, dependencies=[Depends(get_current_username)])
-async def analyze_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
+def analyze_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """
+    Analisa o CSV em streaming e guarda o resultado no servidor. Devolve só as
+    contagens, os primeiros erros e a primeira página de nós novos e duplicados.
+    """
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="O ficheiro deve ser um CSV.")
-
-    content = await file.read()
     try:
-        content_decoded = content.decode("utf-8-sig")
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="Não foi possível descodificar o ficheiro. Verifique se está em formato UTF-8.")
-
-    stream = io.StringIO(content_decoded)
-    try:
-        dialect = csv.Sniffer().sniff(stream.readline(), delimiters=',;')
-        stream.seek(0)
-    except csv.Error:
-        dialect = 'excel'
-        stream.seek(0)
-
-    csv_reader = csv.DictReader(stream, dialect=dialect)
-    
-    if csv_reader.fieldnames:
-        csv_reader.fieldnames = [field.strip() for field in csv_reader.fieldnames]
-
-    required_columns = {'name', 'ip_address', 'wallet_address', 'vps_provider', 'network'}
-    if not csv_reader.fieldnames or not required_columns.issubset(csv_reader.fieldnames):
-        missing = required_columns - set(csv_reader.fieldnames or [])
-        raise HTTPException(status_code=400, detail=f"Colunas em falta no CSV: {', '.join(missing)}")
-
-    analysis = {"new_nodes": [], "duplicate_nodes": [], "errors": []}
-    existing_ips = {res[0] for res in db.query(Node.ip_address).all()}
-
-    for i, row in enumerate(csv_reader):
-        line_num = i + 2
-        try:
-            cleaned_row = {key.strip() if key else key: value.strip() if isinstance(value, str) else value for key, value in row.items()}
-
-            ip_address = cleaned_row.get('ip_address')
-            if not ip_address:
-                analysis["errors"].append(f"Linha {line_num}: ip_address em falta.")
-                continue
-
-            network = cleaned_row.get('network')
-            if network:
-                network = network.lower()
-
-            secondary_ip = cleaned_row.get('secondary_ip')
-            if secondary_ip == '0':
-                secondary_ip = None
-
-            node_data = {
-                "name": cleaned_row.get('name'), "ip_address": ip_address,
-                "wallet_address": cleaned_row.get('wallet_address'), "vps_provider": cleaned_row.get('vps_provider'),
-                "network": network, "secondary_ip": secondary_ip,
-            }
-            
-            node = NodeBase(**node_data)
-
-            if ip_address in existing_ips:
-                analysis["duplicate_nodes"].append(node)
-            else:
-                analysis["new_nodes"].append(node)
-                existing_ips.add(ip_address)
-
-        except ValidationError as e:
-            analysis["errors"].append(f"Linha {line_num}: Erro de validação - {e}")
-        except Exception as e:
-            analysis["errors"].append(f"Linha {line_num}: Erro inesperado - {e}")
-
-    return analysis
-
-@app.post("/nodes/import-processed-nodes/", status_code=status.HTTP_201_CREATED, dependencies=[Depends(get_current_username)])
-async def import_processed_nodes(payload: NodeImportRequest, db: Session = Depends(get_db)):
-    nodes_added = 0
-    nodes_updated = 0
-
-    # Process nodes to create
-    if payload.nodes_to_create:
-        nodes_to_create_data = [node.dict() for node in payload.nodes_to_create]
-        
-        batch_size = 100
-        for i in range(0, len(nodes_to_create_data), batch_size):
-            batch_data = nodes_to_create_data[i:i + batch_size]
-            ips_in_batch = [node['ip_address'] for node in batch_data]
-            
-            locations = get_locations_for_ips_batch(ips_in_batch)
-
-            for node_data in batch_data:
-                location = locations.get(node_data['ip_address'], "Localização não encontrada")
-                db_node = Node(**node_data, location=location)
-                db.add(db_node)
-                nodes_added += 1
-            
-            db.commit()
-            logging.info(f"Lote de {len(batch_data)} nós novos salvo no banco de dados.")
-
-    # Process nodes to update
-    if payload.nodes_to_update:
-        for node_update_data in payload.nodes_to_update:
-            db_node = db.query(Node).filter(Node.ip_address == node_update_data.ip_address).first()
-            if db_node:
-                for key, value in node_update_data.dict().items():
-                    setattr(db_node, key, value)
-                nodes_updated += 1
-        db.commit()
-        logging.info(f"{nodes_updated} nós atualizados no banco de dados.")
+        job = analyze_csv_upload(db, file.file, NodeBase)
+    except CsvImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {
-        "message": f"{nodes_added} nós adicionados, {nodes_updated} nós atualizados com sucesso."
+        "import_id": job.id,
+        "new_count": job.new_rows,
+        "duplicate_count": job.duplicate_rows,
+        "error_count": job.invalid_rows,
+        "errors": json.loads(job.errors),
+        "new_nodes": import_preview(db, job.id, "new", 0, IMPORT_PREVIEW_PAGE_SIZE),
+        "duplicate_nodes": import_preview(db, job.id, "duplicate", 0, IMPORT_PREVIEW_PAGE_SIZE),
     }
 
+@app.get("/nodes/upload-csv/{import_id}/rows", response_model=List[NodeImportPreviewRow], dependencies=[Depends(get_current_username)])
+def read_import_rows(
+    import_id: str,
+    kind: str = Query("new", pattern="^(new|duplicate)$"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(IMPORT_PREVIEW_PAGE_SIZE, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
+    return import_preview(db, import_id, kind, offset, limit)
+
+@app.post("/nodes/upload-csv/{import_id}/import", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(get_current_username)])
+def import_analyzed_csv(import_id: str, payload: StagedImportRequest, db: Session = Depends(get_db)):
+    """Importa uma análise guardada: todos os nós novos e, se pedido, os duplicados que não estejam em skip_ips."""
+    try:
+        job = submit_staged_import(db, import_id, payload.overwrite_duplicates, set(payload.skip_ips))
+    except CsvImportError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"job_id": job.id, "message": f"Importação de {job.total_rows} nós agendada."}
+
+@app.post("/nodes/import-processed-nodes/", status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(get_current_username)])
+def import_processed_nodes(payload: NodeImportRequest, db: Session = Depends(get_db)):
+    """Agenda a importação e devolve o id do job; o progresso é consultado em /nodes/import-jobs/{job_id}."""
+    job = submit_import_job(
+        db, [node.dict() for node in payload.nodes_to_create], [node.dict() for node in payload.nodes_to_update],
+    )
+    return {"job_id": job.id, "message": f"Importação de {job.total_rows} nós agendada."}
+
+@app.get("/nodes/import-jobs/{job_id}", response_model=ImportJobStatus, dependencies=[Depends(get_current_username)])
+async def read_import_job(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    job = await db.get(ImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Importação não encontrada")
+    return import_job_status(job)
 
-@app.get("/status/global/{network}", dependencies=[Depends(get_current_username)])
-def get_global_status(network: str):
-    if network == 'nkn':
-        rpc_endpoints = [
-            'https://mainnet-rpc-node-0001.nkn.org/mainnet/api/wallet',
-            'https://mainnet-rpc-node-0002.nkn.org/mainnet/api/wallet',
-            'https://mainnet-rpc-node-0003.nkn.org/mainnet/api/wallet',
-            'https://mainnet-rpc-node-0004.nkn.org/mainnet/api/wallet',
-        ]
-        heights = []
-        payload = {"jsonrpc": "2.0", "method": "getlatestblockheight", "params": {}, "id": 1}
-        
-        for endpoint in rpc_endpoints:
-            try:
-                response = requests.post(endpoint, json=payload, timeout=5)
-                response.raise_for_status()
-                height = response.json().get('result', 0)
-                if height and isinstance(height, int):
-                    heights.append(height)
-            except requests.RequestException as e:
-                logging.warning(f"Falha ao contatar o endpoint RPC {endpoint}: {e}")
-                continue
-        
-        if heights:
-            max_height = max(heights)
-            return {"label": "Altura Global do Bloco", "value": f"{max_height:,}"}
-        else:
-            logging.error("Não foi possível obter a altura do bloco de nenhum endpoint RPC da NKN.")
-            return {"label": "Altura Global do Bloco", "value": "API Indisponível"}
 
-    if network == 'sentinel':
-        return {"label": "Altura Global do Bloco", "value": "9,876,543 (Mock)"}
-    if network == 'mysterium':
-        try:
-            response = requests.get('https://discovery.mysterium.network/api/v3/nodes?limit=1', timeout=10)
-            response.raise_for_status()
-            total_nodes = response.json().get('total', 0)
-            return {"label": "Total de Nós na Rede", "value": f"{total_nodes:,}"}
-        except requests.RequestException:
-            return {"label": "Total de Nós na Rede", "value": "API Indisponível"}
-    raise HTTPException(status_code=404, detail="Rede desconhecida")
+@app.get("/status/global/{network}", dependencies=[Depends(get_current_username)])
+async def get_global_status(network: str):
+    """Estado global da rede, servido da cache em memória. `updated_at` e `age_seconds` indicam a idade do valor."""
+    if network not in GLOBAL_STATUS_FETCHERS:
+        raise HTTPException(status_code=404, detail="Rede desconhecida")
+    return await global_status_cache.get(network)
 
 
 class SshCredentials(BaseModel):
     username: str
     password: str
 
+def _ssh_modules():
+    """paramiko e o gestor de credenciais só são importados no primeiro uso do SSH (≈0,2 s que o arranque não paga)."""
+    import paramiko
+    from . import ssh_manager
+    return paramiko, ssh_manager
+
 @app.post("/ssh/connect/{node_ip}", status_code=status.HTTP_200_OK, dependencies=[Depends(get_current_username)])
 def ssh_connect(node_ip: str, creds: SshCredentials):
     """
     Testa a conexão SSH e salva as credenciais se a conexão for bem-sucedida.
     """
+    paramiko, ssh_manager = _ssh_modules()
     try:
         client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -608,6 +585,63 @@ async def websocket_test():
         "uvicorn_info": "uvicorn[standard] with WebSocket support"
     }
 
+def _websocket_credentials_valid(credentials: Optional[str]) -> bool:
+    if not credentials or not credentials.startswith('Basic '):
+        return False
+    try:
+        username, password = base64.b64decode(credentials.split('Basic ')[1]).decode('utf-8').split(':', 1)
+    except ValueError:
+        return False
+    return secrets.compare_digest(username, ADMIN_USERNAME) and secrets.compare_digest(password, ADMIN_PASSWORD)
+
+@app.websocket("/ws/nodes")
+async def websocket_nodes_endpoint(websocket: WebSocket):
+    """
+    Canal de atualizações em tempo real do painel. A primeira mensagem do
+    cliente é {"type": "auth", "credentials": "Basic ...", "network": "nkn"};
+    o servidor responde com um snapshot dos nós da rede e depois envia apenas
+    as alterações ({"type": "changes", ...}), agrupadas por nó.
+    """
+    await websocket.accept()
+    try:
+        auth_data = json.loads(await asyncio.wait_for(websocket.receive_text(), timeout=10))
+    except (asyncio.TimeoutError, json.JSONDecodeError, WebSocketDisconnect):
+        await websocket.close(code=1008)
+        return
+    if auth_data.get('type') != 'auth' or not _websocket_credentials_valid(auth_data.get('credentials')):
+        logging.warning("WebSocket /ws/nodes: autenticação recusada.")
+        await websocket.close(code=1008)
+        return
+
+    subscriber, snapshot = await node_broadcaster.subscribe(auth_data.get('network') or None)
+    logging.info(f"Painel ligado a /ws/nodes (rede: {subscriber.network or 'todas'}, {node_broadcaster.subscriber_count} ligados).")
+
+    async def send_updates():
+        await websocket.send_json(snapshot)
+        while True:
+            if not await subscriber.wait(LIVE_KEEPALIVE_INTERVAL):
+                await websocket.send_json({"type": "ping"})
+                continue
+            message = subscriber.take()
+            if message:
+                await websocket.send_json(message)
+            await asyncio.sleep(LIVE_COALESCE_WINDOW)
+
+    async def wait_for_disconnect():
+        # O cliente não envia nada depois da autenticação; isto só serve para detetar o fecho
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.create_task(send_updates()), asyncio.create_task(wait_for_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        node_broadcaster.unsubscribe(subscriber)
+        logging.info(f"Painel desligado de /ws/nodes ({node_broadcaster.subscriber_count} ligados).")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
 @app.websocket("/ws/ssh/{node_ip}")
 async def websocket_ssh_endpoint(websocket: WebSocket, node_ip: str):
     """
@@ -616,6 +650,7 @@ async def websocket_ssh_endpoint(websocket: WebSocket, node_ip: str):
     logging.info(f"WebSocket connection attempt for node: {node_ip}")
     
     await websocket.accept()
+    paramiko, ssh_manager = await asyncio.get_running_loop().run_in_executor(None, _ssh_modules)
     logging.info(f"WebSocket connection accepted for node: {node_ip}")
     
     # Wait for authentication message
@@ -767,6 +802,7 @@ async def websocket_ssh_endpoint(websocket: WebSocket, node_ip: str):
         # Run reader and writer tasks with proper cancellation
         reader_task = asyncio.create_task(read_from_channel())
         writer_task = asyncio.create_task(write_to_channel())
+        SSH_SESSIONS.inc()
 
         try:
             done, pending = await asyncio.wait(
@@ -775,6 +811,7 @@ async def websocket_ssh_endpoint(websocket: WebSocket, node_ip: str):
                 timeout=3600  # 1 hour timeout
             )
         finally:
+            SSH_SESSIONS.dec()
             # Clean up tasks
             for task in [reader_task, writer_task]:
                 if not task.done():
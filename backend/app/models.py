@@ -0,0 +1,165 @@
+from sqlalchemy import Column, Integer, BigInteger, Boolean, String, Text, DateTime, Index, PrimaryKeyConstraint, text
+from datetime import datetime, timezone
+from .database import Base
+
+# Status considerados saudáveis: Online genérico e os estados de sincronização concluída da NKN
+HEALTHY_STATUSES = {'Online', 'PERSIST_FINISHED', 'SYNC_FINISHED'}
+
+# --- Modelos da Base de Dados --- #
+class Node(Base):
+    __tablename__ = "nodes"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, index=True)
+    ip_address = Column(String, unique=True, index=True)
+    secondary_ip = Column(String, nullable=True)
+    vps_provider = Column(String)
+    wallet_address = Column(String, index=True)
+    location = Column(String, default="A ser verificado")  # preenchida em segundo plano (ver app/geolocation.py)
+    network = Column(String, index=True)
+    status = Column(String, default="Aguardando verificação")
+    currentBlock = Column(Integer, default=0)
+    lastUpdate = Column(DateTime, default=datetime.now(timezone.utc))
+    # Versão global da última alteração de status/altura/cadastro (ver app/changes.py)
+    row_version = Column(BigInteger, default=0, server_default=text("0"))
+    # Índices compostos para a paginação por keyset de /nodes/ com filtros por rede
+    __table_args__ = (
+        Index("ix_nodes_network_id", "network", "id"),
+        Index("ix_nodes_network_status_id", "network", "status", "id"),
+        Index("ix_nodes_network_provider_id", "network", "vps_provider", "id"),
+        Index("ix_nodes_network_location_id", "network", "location", "id"),
+        Index("ix_nodes_network_name_id", "network", "name", "id"),
+        Index("ix_nodes_network_block_id", "network", "currentBlock", "id"),
+        Index("ix_nodes_network_row_version", "network", "row_version"),
+    )
+
+class NodeMetrics(Base):
+    """
+    Dados da última verificação de um nó, fora da tabela nodes: tempos
+    (ligação, RPC), classe da falha e, na NKN, vizinhos, relays, uptime e versão.
+    """
+    __tablename__ = "node_metrics"
+    node_id = Column(Integer, primary_key=True)
+    neighbor_count = Column(Integer)
+    relay_message_count = Column(BigInteger)
+    uptime = Column(BigInteger)  # segundos desde o arranque do nó
+    version = Column(String)
+    proposal_submitted = Column(Integer)
+    connect_ms = Column(Integer)  # tempo até a ligação TCP ser aceite
+    rpc_ms = Column(Integer)      # tempo do pedido HTTP/RPC completo, quando a sonda o faz
+    rtt_ms = Column(Integer)      # rpc_ms, ou connect_ms nas sondas só de TCP: a latência usada para ordenar
+    failure = Column(String)      # classe da falha da última verificação (timeout, refused, unreachable, http_error, ...), ou NULL
+    updated_at = Column(DateTime, nullable=False)
+    __table_args__ = (Index("ix_node_metrics_rtt_ms", "rtt_ms"),)
+
+class PollerWorker(Base):
+    __tablename__ = "poller_workers"
+    worker_id = Column(String, primary_key=True)
+    heartbeat_at = Column(DateTime, index=True)
+    alert_queue_depth = Column(Integer, default=0)
+
+class PollerLease(Base):
+    __tablename__ = "poller_leases"
+    shard_id = Column(Integer, primary_key=True)
+    owner = Column(String, nullable=True, index=True)
+    expires_at = Column(DateTime, nullable=True)
+
+class PollerControl(Base):
+    __tablename__ = "poller_control"
+    id = Column(Integer, primary_key=True)
+    refresh_requested_at = Column(DateTime, nullable=True)
+    last_poll_at = Column(DateTime, nullable=True)  # último lote de verificações gravado (ver persist_poll_results)
+
+class NodeStatusSample(Base):
+    """Amostra bruta, apenas de inserção, de cada verificação de um nó."""
+    __tablename__ = "node_status_samples"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    node_id = Column(Integer, nullable=False)
+    sampled_at = Column(DateTime, nullable=False)
+    status = Column(String)
+    currentBlock = Column(Integer)
+    connect_ms = Column(Integer)
+    rpc_ms = Column(Integer)
+    failure = Column(String)
+    __table_args__ = (
+        Index("ix_node_status_samples_node_time", "node_id", "sampled_at"),
+        # BRIN: índice minúsculo para varrer/apagar por tempo numa tabela só de inserção
+        Index("ix_node_status_samples_sampled_at", "sampled_at", postgresql_using="brin"),
+    )
+
+class NodeStatusRollup(Base):
+    """Agregados de 5 minutos (resolution=300) e de 1 hora (resolution=3600)."""
+    __tablename__ = "node_status_rollups"
+    node_id = Column(Integer, nullable=False)
+    resolution = Column(Integer, nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    samples = Column(Integer, nullable=False)
+    online_samples = Column(Integer, nullable=False)
+    min_block = Column(Integer)
+    max_block = Column(Integer)
+    last_status = Column(String)
+    rtt_samples = Column(Integer)  # amostras com latência medida (as falhas não contam)
+    rtt_ms_sum = Column(BigInteger)
+    max_rtt_ms = Column(Integer)
+    __table_args__ = (
+        PrimaryKeyConstraint("node_id", "resolution", "bucket_start"),
+        Index("ix_node_status_rollups_resolution_bucket", "resolution", "bucket_start"),
+    )
+
+class NodeVersionCounter(Base):
+    """Contador único e monotónico de versões da tabela nodes."""
+    __tablename__ = "node_version_counter"
+    id = Column(Integer, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+class NodeDeletion(Base):
+    """Registo dos nós apagados, para que /nodes/changes também entregue as remoções."""
+    __tablename__ = "node_deletions"
+    node_id = Column(Integer, primary_key=True)
+    network = Column(String, index=True)
+    row_version = Column(BigInteger, nullable=False, index=True)
+
+class IpLocation(Base):
+    """Cache persistente de geolocalização por IP, com validade (ver app/geolocation.py)."""
+    __tablename__ = "ip_locations"
+    ip_address = Column(String, primary_key=True)
+    location = Column(String, nullable=False)
+    found = Column(Boolean, nullable=False, default=True)
+    source = Column(String)
+    updated_at = Column(DateTime, nullable=False, index=True)
+
+class ImportJob(Base):
+    """Importação de nós executada em segundo plano (ver app/imports.py)."""
+    __tablename__ = "import_jobs"
+    id = Column(String, primary_key=True)
+    status = Column(String, nullable=False, default="queued")  # analyzed, queued, running, finished, failed
+    # Resultado da análise do CSV (só para importações a partir de um ficheiro)
+    new_rows = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    duplicate_rows = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    invalid_rows = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    total_rows = Column(Integer, nullable=False, default=0)
+    processed_rows = Column(Integer, nullable=False, default=0)
+    created_rows = Column(Integer, nullable=False, default=0)
+    updated_rows = Column(Integer, nullable=False, default=0)
+    errors = Column(Text, nullable=False, default="[]")  # lista JSON, limitada a IMPORT_MAX_ERRORS
+    created_at = Column(DateTime, nullable=False, index=True)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    owner = Column(String)  # processo da API que executa o job (ver heartbeat_import_jobs)
+    heartbeat_at = Column(DateTime)
+
+class ImportRow(Base):
+    """Linhas de um CSV já analisado, à espera da confirmação da importação (ver app/imports.py)."""
+    __tablename__ = "import_rows"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    job_id = Column(String, nullable=False)
+    line = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)  # new, duplicate
+    name = Column(String)
+    ip_address = Column(String, nullable=False)
+    secondary_ip = Column(String)
+    vps_provider = Column(String)
+    wallet_address = Column(String)
+    network = Column(String)
+    __table_args__ = (
+        Index("ix_import_rows_job_kind_id", "job_id", "kind", "id"),
+    )
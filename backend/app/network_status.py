@@ -0,0 +1,153 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Optional
+import aiohttp
+from dotenv import load_dotenv
+from .instrumentation import EXTERNAL_REQUESTS
+
+load_dotenv()
+
+# --- Configurações --- #
+GLOBAL_STATUS_REFRESH_INTERVAL = float(os.getenv("GLOBAL_STATUS_REFRESH_INTERVAL", 30))
+GLOBAL_STATUS_RACE_GRACE = float(os.getenv("GLOBAL_STATUS_RACE_GRACE", 1))  # segundos extra para os outros endpoints depois da primeira resposta
+GLOBAL_STATUS_TIMEOUT = aiohttp.ClientTimeout(total=float(os.getenv("GLOBAL_STATUS_TIMEOUT", 5)))
+
+NKN_RPC_ENDPOINTS = [
+    'https://mainnet-rpc-node-0001.nkn.org/mainnet/api/wallet',
+    'https://mainnet-rpc-node-0002.nkn.org/mainnet/api/wallet',
+    'https://mainnet-rpc-node-0003.nkn.org/mainnet/api/wallet',
+    'https://mainnet-rpc-node-0004.nkn.org/mainnet/api/wallet',
+]
+MYSTERIUM_DISCOVERY_URL = 'https://discovery.mysterium.network/api/v3/nodes?limit=1'
+
+async def _nkn_endpoint_height(session: aiohttp.ClientSession, endpoint: str) -> Optional[int]:
+    payload = {"jsonrpc": "2.0", "method": "getlatestblockheight", "params": {}, "id": 1}
+    try:
+        async with session.post(endpoint, json=payload, timeout=GLOBAL_STATUS_TIMEOUT) as response:
+            response.raise_for_status()
+            height = (await response.json(content_type=None)).get('result', 0)
+            EXTERNAL_REQUESTS.labels("nkn-rpc", "ok").inc()
+            return height if height and isinstance(height, int) else None
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        EXTERNAL_REQUESTS.labels("nkn-rpc", "error").inc()
+        logging.warning(f"Falha ao contatar o endpoint RPC {endpoint}: {e}")
+        return None
+
+async def fetch_nkn_status(session: aiohttp.ClientSession) -> Optional[dict]:
+    # Corrida entre os endpoints: a primeira resposta válida decide, e os restantes têm uma pequena tolerância
+    # para reportar uma altura maior. O pior caso deixa de ser a soma dos timeouts.
+    pending = {asyncio.ensure_future(_nkn_endpoint_height(session, endpoint)) for endpoint in NKN_RPC_ENDPOINTS}
+    heights = []
+    try:
+        while pending and not heights:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            heights += [task.result() for task in done if task.result()]
+        if pending:
+            done, pending = await asyncio.wait(pending, timeout=GLOBAL_STATUS_RACE_GRACE)
+            heights += [task.result() for task in done if task.result()]
+    finally:
+        for task in pending:
+            task.cancel()
+    if not heights:
+        logging.error("Não foi possível obter a altura do bloco de nenhum endpoint RPC da NKN.")
+        return None
+    max_height = max(heights)
+    return {"label": "Altura Global do Bloco", "value": f"{max_height:,}", "height": max_height}
+
+async def fetch_mysterium_status(session: aiohttp.ClientSession) -> Optional[dict]:
+    try:
+        async with session.get(MYSTERIUM_DISCOVERY_URL, timeout=GLOBAL_STATUS_TIMEOUT) as response:
+            response.raise_for_status()
+            total_nodes = (await response.json(content_type=None)).get('total', 0)
+            EXTERNAL_REQUESTS.labels("mysterium-discovery", "ok").inc()
+            return {"label": "Total de Nós na Rede", "value": f"{total_nodes:,}"}
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        EXTERNAL_REQUESTS.labels("mysterium-discovery", "error").inc()
+        logging.warning(f"Falha ao contatar a API de descoberta da Mysterium: {e}")
+        return None
+
+async def fetch_sentinel_status(session: aiohttp.ClientSession) -> Optional[dict]:
+    return {"label": "Altura Global do Bloco", "value": "9,876,543 (Mock)"}
+
+GLOBAL_STATUS_FETCHERS = {
+    'nkn': fetch_nkn_status,
+    'sentinel': fetch_sentinel_status,
+    'mysterium': fetch_mysterium_status,
+}
+UNAVAILABLE_LABELS = {'nkn': "Altura Global do Bloco", 'sentinel': "Altura Global do Bloco", 'mysterium': "Total de Nós na Rede"}
+
+class GlobalStatusCache:
+    """
+    Estado global de cada rede (altura da cadeia, total de nós), atualizado em
+    segundo plano a cada GLOBAL_STATUS_REFRESH_INTERVAL segundos. Quem consulta
+    lê da memória; se uma atualização falhar, mantém-se o último valor bom com
+    a data em que foi obtido.
+    """
+
+    def __init__(self, networks: Iterable[str] = GLOBAL_STATUS_FETCHERS, interval: float = GLOBAL_STATUS_REFRESH_INTERVAL):
+        self.networks = list(networks)
+        self.interval = interval
+        self._entries = {}     # rede -> {"label", "value", ["height"], "updated_at"}
+        self._refreshing = {}  # rede -> tarefa de atualização em curso, partilhada por quem espera
+        self._attempted = set()
+        self._session_factory = None
+        self._task = None
+
+    def start(self, session_factory: Callable[[], aiohttp.ClientSession], networks: Optional[Iterable[str]] = None):
+        self._session_factory = session_factory
+        if networks is not None:
+            self.networks = list(networks)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def height(self, network: str) -> Optional[int]:
+        entry = self._entries.get(network)
+        return entry.get("height") if entry else None
+
+    async def get(self, network: str) -> dict:
+        """Devolve o estado em memória; só espera pela rede na primeira consulta, antes da primeira atualização."""
+        if network not in self._attempted and self._session_factory is not None:
+            await self.refresh(network)
+        entry = self._entries.get(network)
+        if entry is None:
+            return {"label": UNAVAILABLE_LABELS[network], "value": "API Indisponível", "updated_at": None, "age_seconds": None}
+        age = (datetime.now(timezone.utc) - entry["updated_at"]).total_seconds()
+        return {**entry, "age_seconds": round(age)}
+
+    async def refresh(self, network: str):
+        # Pedidos simultâneos para a mesma rede partilham a mesma atualização
+        task = self._refreshing.get(network)
+        if task is None:
+            task = asyncio.create_task(self._refresh(network))
+            self._refreshing[network] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(network, None))
+        await asyncio.shield(task)
+
+    async def _refresh(self, network: str):
+        try:
+            status = await GLOBAL_STATUS_FETCHERS[network](self._session_factory())
+        finally:
+            self._attempted.add(network)
+        if status is not None:
+            self._entries[network] = {**status, "updated_at": datetime.now(timezone.utc)}
+
+    async def _run(self):
+        while True:
+            results = await asyncio.gather(*(self.refresh(network) for network in self.networks), return_exceptions=True)
+            for network, result in zip(self.networks, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Erro ao atualizar o status global da rede {network}: {result}")
+            await asyncio.sleep(self.interval)
+
+global_status_cache = GlobalStatusCache()
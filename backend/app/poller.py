@@ -0,0 +1,624 @@
+import os
+import sys
+import math
+import zlib
+import heapq
+import random
+import signal
+import socket
+import time
+import logging
+import argparse
+import asyncio
+import multiprocessing
+import aiohttp
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from .database import AsyncSessionLocal, SessionLocal, dispose_async_engine, prepare_database
+from .alerts import alert_dispatcher
+from .models import HEALTHY_STATUSES, Node, NodeMetrics, PollerControl, PollerLease, PollerWorker
+from .history import HISTORY_MAINTENANCE_INTERVAL, record_samples, run_history_maintenance
+from .changes import next_node_version
+from .network_status import global_status_cache
+from .probes import ProbeLimiter, check_single_node, probe_trace_config, provider_rate
+from .instrumentation import DB_WRITE_DURATION, POLLER_METRICS_PORT, SWEEP_DURATION
+from prometheus_client import start_http_server
+
+load_dotenv()
+
+# --- Configurações --- #
+POLL_FLUSH_BATCH_SIZE = int(os.getenv("POLL_FLUSH_BATCH_SIZE", 50))
+POLL_FLUSH_INTERVAL = float(os.getenv("POLL_FLUSH_INTERVAL", 2))
+# "service" (a API só lê; a verificação corre no serviço `python -m app.poller`),
+# "adaptive" (agendador por nó dentro da API) ou "sweep" (varredura completa a cada 10 minutos, dentro da API)
+POLL_MODE = os.getenv("POLL_MODE", "service")
+POLL_SWEEP_INTERVAL = int(os.getenv("POLL_SWEEP_INTERVAL", 600))  # segundos entre varreduras completas (modo "sweep")
+POLL_PROBE_BUDGET = int(os.getenv("POLL_PROBE_BUDGET", 600))  # verificações por minuto, por processo
+POLL_FAST_INTERVAL_MIN = float(os.getenv("POLL_FAST_INTERVAL_MIN", 30))
+POLL_FAST_INTERVAL_MAX = float(os.getenv("POLL_FAST_INTERVAL_MAX", 60))
+POLL_STABLE_INTERVAL_MIN = float(os.getenv("POLL_STABLE_INTERVAL_MIN", 120))
+POLL_STABLE_INTERVAL_MAX = float(os.getenv("POLL_STABLE_INTERVAL_MAX", 1800))
+POLL_LAG_BLOCKS = int(os.getenv("POLL_LAG_BLOCKS", 10))
+POLL_RELOAD_INTERVAL = int(os.getenv("POLL_RELOAD_INTERVAL", 60))
+POLL_SHARD_COUNT = int(os.getenv("POLL_SHARD_COUNT", 64))
+POLL_WORKERS = int(os.getenv("POLL_WORKERS", 1))
+POLL_LEASE_TTL = int(os.getenv("POLL_LEASE_TTL", 30))
+POLL_LEASE_HEARTBEAT = int(os.getenv("POLL_LEASE_HEARTBEAT", 10))
+
+PROBE_CONNECTION_LIMIT = int(os.getenv("PROBE_CONNECTION_LIMIT", 100))
+PROBE_CONNECTION_LIMIT_PER_HOST = int(os.getenv("PROBE_CONNECTION_LIMIT_PER_HOST", 2))
+PROBE_DNS_CACHE_TTL = int(os.getenv("PROBE_DNS_CACHE_TTL", 300))
+PROBE_KEEPALIVE_TIMEOUT = float(os.getenv("PROBE_KEEPALIVE_TIMEOUT", 75))
+
+# --- Sessão HTTP Partilhada --- #
+_http_session = None
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Sessão aiohttp única para toda a vida do processo. O connector limita as
+    conexões abertas, guarda o DNS em cache e mantém as conexões keep-alive,
+    para que nós verificados com frequência reutilizem a mesma conexão.
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=PROBE_CONNECTION_LIMIT,
+            limit_per_host=PROBE_CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=PROBE_DNS_CACHE_TTL,
+            keepalive_timeout=PROBE_KEEPALIVE_TIMEOUT,
+        )
+        _http_session = aiohttp.ClientSession(connector=connector, trace_configs=[probe_trace_config()])
+    return _http_session
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+# --- Verificação de Status --- #
+NODE_METRICS_FIELDS = ('neighbor_count', 'relay_message_count', 'uptime', 'version', 'proposal_submitted', 'connect_ms', 'rpc_ms', 'rtt_ms')
+
+def record_node_metrics(db: Session, results, now: datetime):
+    """
+    Grava as métricas devolvidas pelas sondas (tempos, classe da falha e, na
+    NKN, os dados do nó) num único INSERT ... ON CONFLICT (node_id) em
+    node_metrics. Um valor em falta mantém o anterior (ex.: a última latência
+    de um nó agora offline); a falha é sempre a da última verificação. Não mexe
+    na tabela nodes nem na versão de linha: mudam a cada verificação e não
+    devem gerar alterações para os painéis. O commit fica a cargo de quem chama.
+    """
+    rows = {}
+    for node_id, new_status in results:
+        metrics = new_status.get('metrics')
+        if metrics:
+            row = {'node_id': node_id, **{key: metrics.get(key) for key in NODE_METRICS_FIELDS}, 'failure': metrics.get('failure'), 'updated_at': now}
+            if row['rtt_ms'] is None:
+                row['rtt_ms'] = row['rpc_ms'] if row['rpc_ms'] is not None else row['connect_ms']
+            rows[node_id] = row
+    if not rows:
+        return
+    table = NodeMetrics.__table__
+    insert = postgresql_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.node_id],
+        set_={
+            **{key: func.coalesce(stmt.excluded[key], table.c[key]) for key in NODE_METRICS_FIELDS},
+            'failure': stmt.excluded.failure,
+            'updated_at': stmt.excluded.updated_at,
+        },
+    )
+    db.execute(stmt, list(rows.values()))
+
+def _record_last_poll(db: Session, now: datetime):
+    """Hora da última verificação da frota, numa única linha em vez de um UPDATE por nó sem alterações."""
+    control = PollerControl.__table__
+    if db.execute(control.update().where(control.c.id == 1).values(last_poll_at=now)).rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.execute(control.insert().values(id=1, last_poll_at=now))
+    except IntegrityError:
+        # Outro worker criou a linha ao mesmo tempo
+        db.execute(control.update().where(control.c.id == 1).values(last_poll_at=now))
+
+@DB_WRITE_DURATION.labels("poll_results").time()
+def persist_poll_results(db: Session, nodes_by_id: dict, results) -> int:
+    """
+    Grava em lote os resultados de uma varredura, sem um SELECT por nó.
+    Apenas os nós cujo status ou altura mudaram são reescritos (lastUpdate é a
+    hora da última alteração); a hora da última verificação fica numa só linha,
+    poller_control.last_poll_at. Todos os resultados são também anexados ao
+    histórico (node_status_samples).
+    Síncrona: os chamadores no event loop usam-na via AsyncSession.run_sync.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)  # UTC sem tzinfo, como as colunas (o asyncpg recusa datas com fuso)
+    changed_rows = []
+    samples = []
+
+    for node_id, new_status in results:
+        node = nodes_by_id.get(node_id)
+        if node is None:
+            continue
+        samples.append((node_id, new_status))
+
+        if new_status['status'] == node.status and new_status['currentBlock'] == node.currentBlock:
+            continue
+
+        if new_status['status'] == 'Offline' and node.status != 'Offline':
+            alert_dispatcher.enqueue(node.name, node.ip_address)
+
+        changed_rows.append({
+            'id': node_id,
+            'status': new_status['status'],
+            'currentBlock': new_status['currentBlock'],
+            'lastUpdate': now,
+        })
+        # Mantém o snapshot em memória alinhado com o que foi gravado
+        node.status = new_status['status']
+        node.currentBlock = new_status['currentBlock']
+
+    if changed_rows:
+        version = next_node_version(db)
+        for row in changed_rows:
+            row['row_version'] = version
+        db.bulk_update_mappings(Node, changed_rows)
+
+    if samples:
+        _record_last_poll(db, now)
+    record_samples(db, samples, now)
+    record_node_metrics(db, samples, now)
+    db.commit()
+    return len(changed_rows)
+
+async def _probe_into_queue(queue: asyncio.Queue, session: aiohttp.ClientSession, node: Node, limiter: ProbeLimiter):
+    result = None
+    try:
+        result = await check_single_node(session, node, limiter)
+    except Exception as e:
+        logging.error(f"Falha ao verificar o nó {node.name} ({node.ip_address}): {e}")
+    finally:
+        # Sempre sinaliza a conclusão, para que o consumidor saiba quantas verificações faltam
+        queue.put_nowait(result)
+
+def _warn_slow_providers(nodes):
+    """Avisa quando o ritmo configurado para um fornecedor não chega para o verificar dentro de uma varredura."""
+    per_provider = {}
+    for node in nodes:
+        provider = (node.vps_provider or "").strip()
+        if provider:
+            per_provider[provider] = per_provider.get(provider, 0) + 1
+    for provider, count in per_provider.items():
+        needed = count / provider_rate(provider)
+        if needed > POLL_SWEEP_INTERVAL:
+            logging.warning(
+                f"Fornecedor {provider}: {count} nós a {provider_rate(provider):g}/s precisam de {needed:.0f}s, "
+                f"mais do que o intervalo de varredura ({POLL_SWEEP_INTERVAL}s). Ajuste PROBE_PROVIDER_RATES."
+            )
+
+async def update_all_nodes_status():
+    db = AsyncSessionLocal()
+    tasks = []
+    try:
+        logging.info("Iniciando a tarefa de atualização de status dos nós...")
+        sweep_started = time.perf_counter()
+        
+        all_nodes = (await db.execute(select(Node))).scalars().all()
+        total_nodes = len(all_nodes)
+        
+        if total_nodes == 0:
+            logging.info("Nenhum nó para atualizar.")
+            return
+
+        # Desanexa os nós da sessão: servem de snapshot do último estado conhecido
+        # e não são recarregados nem expirados pelos commits em lote.
+        db.expunge_all()
+        nodes_by_id = {node.id: node for node in all_nodes}
+        _warn_slow_providers(all_nodes)
+
+        limiter = ProbeLimiter()  # vagas por rede, debaixo do teto global PROBE_CONCURRENCY
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        changed_count = 0
+        flushes = 0
+
+        session = get_http_session()
+        tasks = [asyncio.create_task(_probe_into_queue(queue, session, node, limiter)) for node in all_nodes]
+
+        # Grava os resultados à medida que chegam, em lotes limitados por tamanho
+        # ou por tempo, para que um IP lento não atrase a atualização dos demais.
+        buffer = []
+        remaining = total_nodes
+        deadline = loop.time() + POLL_FLUSH_INTERVAL
+        while remaining:
+            try:
+                result = await asyncio.wait_for(queue.get(), timeout=max(0, deadline - loop.time()))
+                remaining -= 1
+                if result is not None:
+                    buffer.append(result)
+            except asyncio.TimeoutError:
+                pass
+
+            if len(buffer) >= POLL_FLUSH_BATCH_SIZE or loop.time() >= deadline:
+                if buffer:
+                    changed_count += await db.run_sync(persist_poll_results, nodes_by_id, buffer)
+                    flushes += 1
+                    buffer = []
+                deadline = loop.time() + POLL_FLUSH_INTERVAL
+
+        if buffer:
+            changed_count += await db.run_sync(persist_poll_results, nodes_by_id, buffer)
+            flushes += 1
+
+        SWEEP_DURATION.observe(time.perf_counter() - sweep_started)
+        logging.info(f"Tarefa de atualização de status concluída. {changed_count}/{total_nodes} nós com alteração de status ou altura, gravados em {flushes} lotes.")
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await db.close()
+
+# --- Agendador Adaptativo --- #
+def shard_for_ip(ip_address: str) -> int:
+    """Shard estável de um nó: o mesmo IP cai sempre no mesmo shard, em qualquer processo."""
+    return zlib.crc32(ip_address.encode()) % POLL_SHARD_COUNT
+
+class AdaptivePollScheduler:
+    """
+    Agenda a verificação de cada nó individualmente, numa fila de prioridade
+    ordenada pelo próximo horário devido. Nós instáveis, com alteração recente
+    ou atrasados em altura são verificados a cada 30-60 s; nós estáveis e
+    saudáveis têm o intervalo dobrado até POLL_STABLE_INTERVAL_MAX.
+    """
+
+    def __init__(self, probe_budget: int, shards: set = None):
+        self.probe_budget = probe_budget  # verificações por minuto
+        self.shards = shards  # None = todos os nós; caso contrário, só os shards deste worker
+        self._heap = []       # (horário devido, node_id)
+        self._due = {}        # node_id -> horário devido atual (entradas antigas no heap são ignoradas)
+        self._nodes = {}      # node_id -> snapshot desanexado do nó
+        self._intervals = {}  # node_id -> último intervalo usado
+        self._max_height = {} # rede -> maior altura conhecida na frota
+        self._buffer = []
+        self._inflight = set()
+        self._tokens = float(probe_budget)
+        self._task = None
+
+    @property
+    def queue_size(self) -> int:
+        return len(self._due)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def request_full_refresh(self):
+        """Marca todos os nós como devidos agora, com orçamento para uma ronda completa."""
+        now = asyncio.get_running_loop().time()
+        for node_id in self._nodes:
+            if node_id in self._due:
+                self._schedule(node_id, now)
+        self._tokens = max(self._tokens, float(len(self._nodes)))
+
+    async def reload_nodes(self):
+        """Sincroniza a fila com a tabela de nós: inclui os novos e remove os apagados."""
+        async with AsyncSessionLocal() as db:
+            nodes = (await db.execute(select(Node))).scalars().all()
+            db.expunge_all()
+
+        now = asyncio.get_running_loop().time()
+        if self.shards is not None:
+            nodes = [node for node in nodes if shard_for_ip(node.ip_address) in self.shards]
+
+        current_ids = set()
+        for node in nodes:
+            current_ids.add(node.id)
+            is_new = node.id not in self._nodes
+            self._nodes[node.id] = node
+            self._track_height(node.network, node.currentBlock)
+            if is_new:
+                # Espalha a primeira verificação para evitar uma rajada no arranque
+                self._schedule(node.id, now + random.uniform(0, POLL_FAST_INTERVAL_MAX))
+
+        for node_id in set(self._nodes) - current_ids:
+            self._nodes.pop(node_id, None)
+            self._due.pop(node_id, None)
+            self._intervals.pop(node_id, None)
+
+        logging.info(f"Fila de verificação adaptativa: {len(self._nodes)} nós, {len(self._inflight)} verificações em curso.")
+
+    def _schedule(self, node_id: int, due: float):
+        self._due[node_id] = due
+        heapq.heappush(self._heap, (due, node_id))
+
+    def _track_height(self, network: str, height):
+        if height and height > self._max_height.get(network, 0):
+            self._max_height[network] = height
+
+    def _next_interval(self, node: Node, new_status: dict) -> float:
+        changed = new_status['status'] != node.status
+        unhealthy = new_status['status'] not in HEALTHY_STATUSES
+        # A altura de referência é a da cadeia (cache do status global); a maior da frota cobre a falta dela
+        fleet_height = max(self._max_height.get(node.network, 0), global_status_cache.height(node.network) or 0)
+        lagging = node.network == 'nkn' and fleet_height - (new_status['currentBlock'] or 0) > POLL_LAG_BLOCKS
+
+        if changed or unhealthy or lagging:
+            return random.uniform(POLL_FAST_INTERVAL_MIN, POLL_FAST_INTERVAL_MAX)
+
+        previous = self._intervals.get(node.id, POLL_STABLE_INTERVAL_MIN)
+        interval = min(max(previous * 2, POLL_STABLE_INTERVAL_MIN), POLL_STABLE_INTERVAL_MAX)
+        return interval * random.uniform(0.9, 1.1)
+
+    async def _probe(self, session: aiohttp.ClientSession, node: Node, limiter: ProbeLimiter):
+        try:
+            node_id, new_status = await check_single_node(session, node, limiter)
+        except Exception as e:
+            logging.error(f"Falha ao verificar o nó {node.name} ({node.ip_address}): {e}")
+            node_id, new_status = node.id, {'status': node.status, 'currentBlock': node.currentBlock}
+        else:
+            self._buffer.append((node_id, new_status))
+
+        if node_id not in self._nodes:
+            return  # O nó foi apagado durante a verificação
+        self._track_height(node.network, new_status['currentBlock'])
+        interval = self._next_interval(node, new_status)
+        self._intervals[node_id] = interval
+        self._schedule(node_id, asyncio.get_running_loop().time() + interval)
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, []
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.run_sync(persist_poll_results, self._nodes, buffer)
+        except Exception as e:
+            logging.error(f"Falha ao gravar {len(buffer)} resultados de verificação: {e}")
+
+    def _refill_tokens(self, elapsed: float):
+        # O limite só se aplica à recarga normal: o crédito extra de uma atualização completa é gasto, não cortado
+        if self._tokens < self.probe_budget:
+            self._tokens = min(float(self.probe_budget), self._tokens + elapsed * self.probe_budget / 60)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        limiter = ProbeLimiter()
+        await self.reload_nodes()
+        last_tick = loop.time()
+        last_flush = last_tick
+
+        try:
+            session = get_http_session()
+            while True:
+                now = loop.time()
+                self._refill_tokens(now - last_tick)
+                last_tick = now
+
+                while self._heap and self._heap[0][0] <= now and self._tokens >= 1:
+                    due, node_id = heapq.heappop(self._heap)
+                    if self._due.get(node_id) != due:
+                        continue  # Entrada obsoleta (reagendada ou apagada)
+                    del self._due[node_id]
+                    self._tokens -= 1
+                    task = asyncio.create_task(self._probe(session, self._nodes[node_id], limiter))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+
+                if len(self._buffer) >= POLL_FLUSH_BATCH_SIZE or now - last_flush >= POLL_FLUSH_INTERVAL:
+                    await self._flush()
+                    last_flush = now
+
+                await asyncio.sleep(1)
+        finally:
+            for task in list(self._inflight):
+                task.cancel()
+            await self._flush()
+
+adaptive_scheduler = AdaptivePollScheduler(POLL_PROBE_BUDGET)
+
+# --- Workers com Shards --- #
+class ShardLeaseManager:
+    """
+    Divide os POLL_SHARD_COUNT shards entre os workers vivos através de leases
+    na tabela poller_leases. Cada worker renova os seus leases a cada heartbeat;
+    quando um worker morre, os leases expiram e são reivindicados pelos restantes.
+    """
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self.owned = set()
+
+    def _ensure_shards(self, db: Session):
+        existing = {row[0] for row in db.query(PollerLease.shard_id).all()}
+        missing = [{'shard_id': shard_id} for shard_id in range(POLL_SHARD_COUNT) if shard_id not in existing]
+        if missing:
+            db.bulk_insert_mappings(PollerLease, missing)
+            db.commit()
+
+    def heartbeat(self) -> set:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)  # UTC sem tzinfo, como as colunas: com fuso o psycopg2 envia timestamptz
+        expires_at = now + timedelta(seconds=POLL_LEASE_TTL)
+        stale_before = now - timedelta(seconds=POLL_LEASE_TTL)
+        db = SessionLocal()
+        try:
+            try:
+                self._ensure_shards(db)
+            except Exception:
+                db.rollback()  # Outro worker criou os shards ao mesmo tempo
+
+            db.merge(PollerWorker(worker_id=self.worker_id, heartbeat_at=now, alert_queue_depth=alert_dispatcher.queue_depth))
+            db.query(PollerWorker).filter(PollerWorker.heartbeat_at < stale_before).delete(synchronize_session=False)
+            live_workers = max(1, db.query(PollerWorker).count())
+            fair_share = math.ceil(POLL_SHARD_COUNT / live_workers)
+
+            db.query(PollerLease).filter(PollerLease.owner == self.worker_id).update(
+                {PollerLease.expires_at: expires_at}, synchronize_session=False)
+            owned = sorted(row[0] for row in db.query(PollerLease.shard_id).filter(PollerLease.owner == self.worker_id).all())
+
+            if len(owned) > fair_share:
+                # Devolve o excedente para que um worker novo receba a sua parte
+                extra = owned[fair_share:]
+                db.query(PollerLease).filter(PollerLease.shard_id.in_(extra), PollerLease.owner == self.worker_id).update(
+                    {PollerLease.owner: None, PollerLease.expires_at: None}, synchronize_session=False)
+                owned = owned[:fair_share]
+            elif len(owned) < fair_share:
+                free = db.query(PollerLease.shard_id).filter(
+                    (PollerLease.owner.is_(None)) | (PollerLease.expires_at < now)
+                ).order_by(PollerLease.shard_id).limit(fair_share - len(owned)).all()
+                for (shard_id,) in free:
+                    # UPDATE condicional: só um worker ganha a disputa por um shard livre
+                    claimed = db.query(PollerLease).filter(
+                        PollerLease.shard_id == shard_id,
+                        (PollerLease.owner.is_(None)) | (PollerLease.expires_at < now),
+                    ).update({PollerLease.owner: self.worker_id, PollerLease.expires_at: expires_at}, synchronize_session=False)
+                    if claimed:
+                        owned.append(shard_id)
+
+            db.commit()
+            self.owned = set(owned)
+        except Exception as e:
+            db.rollback()
+            logging.error(f"Worker {self.worker_id}: falha ao renovar leases de shards: {e}")
+        finally:
+            db.close()
+        return self.owned
+
+    def release_all(self):
+        db = SessionLocal()
+        try:
+            db.query(PollerLease).filter(PollerLease.owner == self.worker_id).update(
+                {PollerLease.owner: None, PollerLease.expires_at: None}, synchronize_session=False)
+            db.query(PollerWorker).filter(PollerWorker.worker_id == self.worker_id).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        self.owned = set()
+
+async def request_poller_refresh(db: AsyncSession):
+    """Sinaliza ao serviço de verificação que todos os nós devem ser verificados já."""
+    await db.merge(PollerControl(id=1, refresh_requested_at=datetime.now(timezone.utc).replace(tzinfo=None)))
+    await db.commit()
+
+async def _read_refresh_request():
+    async with AsyncSessionLocal() as db:
+        control = await db.get(PollerControl, 1)
+        return control.refresh_requested_at if control else None
+
+async def _history_maintenance_loop(poller: AdaptivePollScheduler):
+    """Manutenção do histórico numa tarefa própria, para uma passagem longa não atrasar os heartbeats das leases."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(HISTORY_MAINTENANCE_INTERVAL)
+        # Corre num único worker: o dono do shard 0
+        if 0 in poller.shards:
+            await loop.run_in_executor(None, run_history_maintenance)
+
+async def run_shard_worker(worker_id: str):
+    loop = asyncio.get_running_loop()
+    current_task = asyncio.current_task()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, current_task.cancel)
+
+    leases = ShardLeaseManager(worker_id)
+    poller = AdaptivePollScheduler(POLL_PROBE_BUDGET, shards=set())
+    alert_dispatcher.start()
+    global_status_cache.start(get_http_session, networks=['nkn'])
+    poller.start()
+    maintenance_task = asyncio.create_task(_history_maintenance_loop(poller))
+    last_reload = loop.time()
+    last_refresh_request = await _read_refresh_request()
+    logging.info(f"Worker {worker_id} iniciado ({POLL_SHARD_COUNT} shards no total).")
+
+    try:
+        while True:
+            owned = await loop.run_in_executor(None, leases.heartbeat)
+            if owned != poller.shards:
+                logging.info(f"Worker {worker_id}: {len(owned)} shards atribuídos.")
+                poller.shards = set(owned)
+                await poller.reload_nodes()
+                last_reload = loop.time()
+            elif loop.time() - last_reload >= POLL_RELOAD_INTERVAL:
+                await poller.reload_nodes()
+                last_reload = loop.time()
+
+            refresh_request = await _read_refresh_request()
+            if refresh_request and refresh_request != last_refresh_request:
+                logging.info(f"Worker {worker_id}: atualização completa solicitada pela API.")
+                await poller.reload_nodes()  # inclui nós criados desde o último reload
+                poller.request_full_refresh()
+                last_refresh_request = refresh_request
+            await asyncio.sleep(POLL_LEASE_HEARTBEAT)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        maintenance_task.cancel()
+        await asyncio.gather(maintenance_task, return_exceptions=True)
+        await poller.stop()
+        await global_status_cache.stop()
+        await alert_dispatcher.stop()
+        await close_http_session()
+        await dispose_async_engine()
+        leases.release_all()
+        logging.info(f"Worker {worker_id} encerrado; shards devolvidos.")
+
+async def _prepare_database():
+    await prepare_database()
+    # As conexões do pool ficam presas a este event loop; cada worker abre as suas no seu
+    await dispose_async_engine()
+
+def _worker_process(index: int):
+    logging.basicConfig(level=logging.INFO)
+    if POLLER_METRICS_PORT:
+        start_http_server(POLLER_METRICS_PORT + index)
+        logging.info(f"Métricas do worker {index} em :{POLLER_METRICS_PORT + index}/metrics")
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    asyncio.run(run_shard_worker(worker_id))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serviço de verificação de status dos nós.")
+    parser.add_argument("--workers", type=int, default=POLL_WORKERS, help="Número de processos worker neste host.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_prepare_database())
+
+    if args.workers <= 1:
+        _worker_process(0)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=_worker_process, args=(i,), name=f"poller-{i}") for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    # docker stop só sinaliza o PID 1: repassa o SIGTERM aos workers para devolverem os shards
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for process in processes:
+            process.join()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
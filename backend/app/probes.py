@@ -0,0 +1,414 @@
+import os
+import time
+import asyncio
+import logging
+import contextlib
+import ipaddress
+from typing import Awaitable, Callable, Optional
+import aiohttp
+from dotenv import load_dotenv
+from .models import Node
+from .scanner import ERROR, OPEN, REFUSED, TIMEOUT, UNREACHABLE, connect_timed
+from .instrumentation import CONNECT_RESULTS, PROBE_DURATION, PROBE_RESULTS, PROBE_WAIT
+
+load_dotenv()
+
+# --- Configurações --- #
+PROBE_CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", 100))  # teto global de verificações simultâneas, somando todas as redes
+# Ritmo por fornecedor de VPS e por sub-rede (verificações por segundo e rajada), para não parecer um scan
+PROBE_PROVIDER_RATE = float(os.getenv("PROBE_PROVIDER_RATE", 20))
+PROBE_PROVIDER_BURST = int(os.getenv("PROBE_PROVIDER_BURST", 20))
+PROBE_PROVIDER_RATES = os.getenv("PROBE_PROVIDER_RATES", "")  # exceções por fornecedor, ex.: "RN=5,Hetzner=50"
+PROBE_SUBNET_RATE = float(os.getenv("PROBE_SUBNET_RATE", 2))
+PROBE_SUBNET_BURST = int(os.getenv("PROBE_SUBNET_BURST", 4))
+PROBE_SUBNET_PREFIX = int(os.getenv("PROBE_SUBNET_PREFIX", 24))
+PROBE_SUBNET_PREFIX_V6 = int(os.getenv("PROBE_SUBNET_PREFIX_V6", 64))
+PROBE_CONNECT_TIMEOUT = float(os.getenv("PROBE_CONNECT_TIMEOUT", 3))
+PROBE_PREFERRED_HEAD_START = float(os.getenv("PROBE_PREFERRED_HEAD_START", 0.25))  # vantagem da última porta que respondeu
+SENTINEL_PORTS = [443, 80, 8553, 2624]
+MYSTERIUM_PORT = 4050
+NKN_RPC_PORT = 30003
+
+PROBE_TIMEOUT_GRACE = 1  # folga sobre o timeout da sonda antes de a cancelar à força
+
+DEFAULT_PROBE = "default"  # entrada usada pelas redes sem sonda própria
+
+# Classes de falha gravadas em node_metrics.failure e no histórico, além das do scanner (timeout, refused, unreachable, error)
+HTTP_ERROR = "http_error"    # ligou, mas o pedido HTTP/RPC devolveu um erro
+RPC_TIMEOUT = "rpc_timeout"  # ligou, mas a resposta não chegou a tempo
+RPC_ERROR = "rpc_error"      # ligou, mas a resposta veio cortada ou inválida
+
+def _ms(seconds: float) -> int:
+    return round(seconds * 1000)
+
+# --- Sondagem TCP --- #
+_open_ports = {}  # ip -> última porta que aceitou ligação
+
+async def _connect(ip: str, port: int, timeout: float) -> tuple:
+    result, seconds = await connect_timed(ip, port, timeout)
+    return port, result, seconds
+
+def _race_failure(failures: list) -> str:
+    # Uma recusa prova que o host está vivo (só o serviço não): é a falha mais informativa
+    for failure in (REFUSED, UNREACHABLE, ERROR):
+        if failure in failures:
+            return failure
+    return TIMEOUT
+
+async def race_connect(ip: str, ports: list, timeout: float = PROBE_CONNECT_TIMEOUT) -> tuple:
+    """
+    Tenta as portas em paralelo e devolve a primeira que aceitar a ligação,
+    cancelando as restantes: (porta, segundos até ligar, None), ou
+    (None, None, classe da falha). A porta que respondeu da última vez
+    começa PROBE_PREFERRED_HEAD_START segundos antes das outras, para que um
+    nó saudável custe uma só ligação; o pior caso é um único timeout.
+    """
+    loop = asyncio.get_running_loop()
+    preferred = _open_ports.get(ip)
+    first = [preferred] if preferred in ports and len(ports) > 1 else list(ports)
+    rest = [port for port in ports if port not in first]
+    rest_at = loop.time() + PROBE_PREFERRED_HEAD_START
+    deadline = loop.time() + timeout + (PROBE_PREFERRED_HEAD_START if rest else 0)
+    pending = {asyncio.ensure_future(_connect(ip, port, deadline - loop.time())) for port in first}
+    failures = []
+    try:
+        while pending or rest:
+            if rest and (not pending or loop.time() >= rest_at):
+                pending |= {asyncio.ensure_future(_connect(ip, port, deadline - loop.time())) for port in rest}
+                rest = []
+            wait_until = rest_at if rest else deadline
+            done, pending = await asyncio.wait(pending, timeout=max(0, wait_until - loop.time()), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                port, result, seconds = task.result()
+                if result == OPEN:
+                    _open_ports[ip] = port
+                    return port, seconds, None
+                failures.append(result)
+            if not rest and loop.time() >= deadline:
+                break
+        _open_ports.pop(ip, None)
+        return None, None, _race_failure(failures)
+    finally:
+        for task in pending:
+            task.cancel()
+
+# --- Tempos dos Pedidos HTTP --- #
+async def _on_connection_create_start(session, context, params):
+    if isinstance(context.trace_request_ctx, dict):
+        context.trace_request_ctx['_connect_started'] = time.perf_counter()
+
+async def _on_connection_create_end(session, context, params):
+    details = context.trace_request_ctx
+    if isinstance(details, dict) and '_connect_started' in details:
+        details['connect_ms'] = _ms(time.perf_counter() - details.pop('_connect_started'))
+
+def probe_trace_config() -> aiohttp.TraceConfig:
+    """
+    Mede o tempo de ligação dos pedidos HTTP das sondas, que passam os seus
+    detalhes em trace_request_ctx. Numa ligação keep-alive reutilizada não há
+    ligação nova, e fica o último tempo medido.
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(_on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    return trace_config
+
+def _http_failure(error: Exception) -> str:
+    if isinstance(error, aiohttp.ClientResponseError) and not isinstance(error, aiohttp.ContentTypeError):
+        return HTTP_ERROR
+    if isinstance(error, asyncio.TimeoutError):
+        return RPC_TIMEOUT
+    return RPC_ERROR
+
+# --- Registo de Sondas --- #
+# Uma sonda recebe (sessão, nó, timeout, detalhes), respeita esse timeout e devolve None
+# se o nó estiver inacessível, ou os campos a atualizar ({'status', ['currentBlock'], ['metrics']}).
+# Em `detalhes` anota o que mediu: connect_ms, rpc_ms e a classe da falha (failure), se houve.
+ProbeFunc = Callable[[aiohttp.ClientSession, Node, float, dict], Awaitable[Optional[dict]]]
+
+class ProbeSpec:
+    """Sonda de uma rede e o seu orçamento: timeout por tentativa, novas tentativas e verificações simultâneas."""
+
+    def __init__(self, network: str, probe: ProbeFunc, timeout: float, retries: int, retry_delay: float, concurrency: int):
+        self.network = network
+        self.probe = probe
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.concurrency = concurrency
+
+PROBES = {}
+
+def register_probe(network: str, *, timeout: float, retries: int = 0, retry_delay: float = 1, concurrency: int = 20):
+    """
+    Regista a sonda de uma rede. Cada valor pode ser ajustado no .env com
+    PROBE_<REDE>_TIMEOUT, PROBE_<REDE>_RETRIES, PROBE_<REDE>_RETRY_DELAY e
+    PROBE_<REDE>_CONCURRENCY (ex.: PROBE_SENTINEL_CONCURRENCY=50).
+    """
+    prefix = f"PROBE_{network.upper()}_"
+    def decorator(probe: ProbeFunc) -> ProbeFunc:
+        PROBES[network] = ProbeSpec(
+            network, probe,
+            timeout=float(os.getenv(prefix + "TIMEOUT", timeout)),
+            retries=int(os.getenv(prefix + "RETRIES", retries)),
+            retry_delay=float(os.getenv(prefix + "RETRY_DELAY", retry_delay)),
+            concurrency=int(os.getenv(prefix + "CONCURRENCY", concurrency)),
+        )
+        return probe
+    return decorator
+
+def get_probe(network: str) -> ProbeSpec:
+    return PROBES.get(network) or PROBES[DEFAULT_PROBE]
+
+def _parse_provider_rates(raw: str) -> dict:
+    rates = {}
+    for item in raw.split(","):
+        provider, _, rate = item.partition("=")
+        if provider.strip() and rate.strip():
+            rates[provider.strip()] = float(rate)
+    return rates
+
+_provider_rates = _parse_provider_rates(PROBE_PROVIDER_RATES)
+
+def provider_rate(provider: str) -> float:
+    return _provider_rates.get(provider, PROBE_PROVIDER_RATE)
+
+def subnet_key(ip: str) -> str:
+    """Prefixo de rede do IP (/24 em IPv4, /64 em IPv6); nomes de host ficam como estão."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    prefix = PROBE_SUBNET_PREFIX if address.version == 4 else PROBE_SUBNET_PREFIX_V6
+    return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+
+class TokenBucket:
+    """
+    Balde de fichas assíncrono: até `burst` verificações seguidas e depois
+    `rate` por segundo. Cada pedido reserva o seu instante na fila, por isso
+    quem espera é servido por ordem de chegada e as verificações ficam
+    espaçadas de forma uniforme em vez de saírem em rajadas.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1 / rate
+        self.burst = max(1, burst)
+        self._next = 0.0  # instante teórico em que o balde volta a ficar vazio
+
+    def reserve(self, now: float) -> float:
+        """Reserva uma ficha e devolve quantos segundos faltam até poder ser usada."""
+        start = max(now, self._next - (self.burst - 1) * self.interval)
+        self._next = max(self._next, now) + self.interval
+        return start - now
+
+    async def acquire(self):
+        delay = self.reserve(asyncio.get_running_loop().time())
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class ProbeLimiter:
+    """
+    Limites de uma ronda de verificações. Primeiro as vagas: um semáforo por
+    rede, debaixo de um teto global. A vaga da rede é obtida primeiro, por isso
+    uma rede lenta (ex.: muitos nós Sentinel em timeout) nunca ocupa mais do
+    que a sua parte e as outras continuam a avançar. Depois, já com a vaga, o
+    ritmo: um balde de fichas por fornecedor de VPS e outro por sub-rede, para
+    que uma frota concentrada em poucos fornecedores e /24 não receba rajadas
+    de ligações. A ficha é gasta mesmo antes da ligação: quem espera por uma
+    vaga não acumula fichas para depois arrancar em bloco quando as vagas
+    libertam. Tudo é criado sob demanda, dentro do event loop que o usa.
+    """
+
+    def __init__(self, total: int = PROBE_CONCURRENCY):
+        self.total = total
+        self._global = None
+        self._networks = {}
+        self._providers = {}
+        self._subnets = {}
+
+    async def pace(self, node: Node):
+        provider = (node.vps_provider or "").strip()
+        if provider:
+            bucket = self._providers.get(provider)
+            if bucket is None:
+                bucket = self._providers[provider] = TokenBucket(provider_rate(provider), PROBE_PROVIDER_BURST)
+            await bucket.acquire()
+        subnet = subnet_key(node.ip_address)
+        bucket = self._subnets.get(subnet)
+        if bucket is None:
+            bucket = self._subnets[subnet] = TokenBucket(PROBE_SUBNET_RATE, PROBE_SUBNET_BURST)
+        await bucket.acquire()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, spec: ProbeSpec, node: Node):
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.total)
+        semaphore = self._networks.get(spec.network)
+        if semaphore is None:
+            semaphore = self._networks[spec.network] = asyncio.Semaphore(spec.concurrency)
+        async with semaphore, self._global:
+            await self.pace(node)
+            yield
+
+async def check_single_node(session: aiohttp.ClientSession, node: Node, limiter: ProbeLimiter):
+    spec = get_probe(node.network)
+    # Default to the last known status, to avoid flapping
+    new_status = {'status': node.status, 'currentBlock': node.currentBlock}
+    result = None
+
+    for attempt in range(spec.retries + 1):
+        if attempt:
+            await asyncio.sleep(spec.retry_delay)  # a espera é feita fora da vaga, que fica livre para outros nós
+        waiting_since = time.perf_counter()
+        async with limiter.slot(spec, node):
+            started = time.perf_counter()
+            PROBE_WAIT.labels(spec.network).observe(started - waiting_since)
+            details = {'connect_ms': None, 'rpc_ms': None, 'failure': None}
+            try:
+                result = await asyncio.wait_for(spec.probe(session, node, spec.timeout, details), spec.timeout + PROBE_TIMEOUT_GRACE)
+            except asyncio.TimeoutError:
+                result = None
+                details['failure'] = TIMEOUT
+            except Exception as e:
+                logging.error(f"Erro inesperado ao verificar o nó {node.name} ({node.ip_address}): {e}")
+                result = None
+                details['failure'] = ERROR
+            details.pop('_connect_started', None)
+            PROBE_DURATION.labels(spec.network).observe(time.perf_counter() - started)
+        if result is not None:
+            break
+
+    if result is None:
+        new_status['status'] = 'Offline'
+    else:
+        new_status.update(result)
+    # Tempos e classe da falha seguem com as métricas do nó (node_metrics e histórico)
+    new_status['metrics'] = {**new_status.get('metrics', {}), **details}
+    PROBE_RESULTS.labels(spec.network, 'online' if result is not None else details['failure'] or ERROR).inc()
+    return node.id, new_status
+
+# --- Sondas por Rede --- #
+# Um único pedido JSON-RPC em lote: estado, vizinhos e versão na mesma ida e volta
+NKN_RPC_BATCH = [
+    {"jsonrpc": "2.0", "method": "getnodestate", "params": {}, "id": "state"},
+    {"jsonrpc": "2.0", "method": "getneighbor", "params": {}, "id": "neighbor"},
+    {"jsonrpc": "2.0", "method": "getversion", "params": {}, "id": "version"},
+]
+_nkn_no_batch = set()  # IPs de nós que não aceitam pedidos em lote
+
+async def _nkn_rpc(session: aiohttp.ClientSession, url: str, payload, timeout: aiohttp.ClientTimeout, details: dict = None):
+    async with session.post(url, json=payload, timeout=timeout, trace_request_ctx=details) as response:
+        response.raise_for_status()
+        return await response.json(content_type=None)
+
+async def _nkn_rpc_results(session: aiohttp.ClientSession, ip: str, timeout: aiohttp.ClientTimeout, details: dict = None) -> dict:
+    """Resultado de cada pedido de NKN_RPC_BATCH, por id. Erros no getnodestate propagam-se; nos restantes ficam None."""
+    url = f"http://{ip}:{NKN_RPC_PORT}"
+    if ip not in _nkn_no_batch:
+        try:
+            data = await _nkn_rpc(session, url, NKN_RPC_BATCH, timeout, details)
+        except aiohttp.ClientResponseError:
+            data = None  # erro HTTP: o nó pode não aceitar lotes
+        if isinstance(data, list):
+            return {item.get('id'): item.get('result') for item in data if isinstance(item, dict)}
+        logging.info(f"Nó NKN {ip} não aceita pedidos JSON-RPC em lote; a usar pedidos individuais.")
+        _nkn_no_batch.add(ip)
+
+    # Sem lotes: os mesmos pedidos um a um, na mesma ligação keep-alive
+    state = await _nkn_rpc(session, url, NKN_RPC_BATCH[0], timeout, details)
+    results = {'state': state.get('result') if isinstance(state, dict) else None}
+    for request in NKN_RPC_BATCH[1:]:
+        try:
+            data = await _nkn_rpc(session, url, request, timeout, details)
+            results[request['id']] = data.get('result') if isinstance(data, dict) else None
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            results[request['id']] = None
+    return results
+
+def _nkn_metrics(state: dict, neighbors, version) -> dict:
+    return {
+        'neighbor_count': len(neighbors) if isinstance(neighbors, list) else None,
+        'relay_message_count': state.get('relayMessageCount'),
+        'uptime': state.get('uptime'),
+        'version': version if isinstance(version, str) else state.get('version'),
+        'proposal_submitted': state.get('proposalSubmitted'),
+    }
+
+@register_probe('nkn', timeout=10, concurrency=60)
+async def probe_nkn(session: aiohttp.ClientSession, node: Node, timeout: float, details: dict) -> Optional[dict]:
+    # Uma única conexão por nó: a fase de connect do próprio JSON-RPC
+    # substitui a antiga verificação TCP prévia na porta 30003.
+    rpc_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout / 2, sock_read=timeout / 2)
+    started = time.perf_counter()
+    try:
+        results = await _nkn_rpc_results(session, node.ip_address, rpc_timeout, details)
+    except aiohttp.ConnectionTimeoutError:
+        CONNECT_RESULTS.labels(TIMEOUT).inc()
+        details['failure'] = TIMEOUT
+        return None
+    except aiohttp.ClientConnectorError as e:
+        # Porta fechada ou inacessível
+        details['failure'] = REFUSED if isinstance(e.os_error, ConnectionRefusedError) else UNREACHABLE
+        CONNECT_RESULTS.labels(details['failure']).inc()
+        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        # Connection was established but the API call failed, so the port is open: keep it as 'Online'
+        CONNECT_RESULTS.labels(OPEN).inc()
+        details['failure'] = _http_failure(e)
+        return {'status': 'Online'}
+    CONNECT_RESULTS.labels(OPEN).inc()
+    details['rpc_ms'] = _ms(time.perf_counter() - started)
+    state = results.get('state')
+    if not isinstance(state, dict):
+        details['failure'] = RPC_ERROR
+        return {'status': 'Online'}  # o nó respondeu, mas com um erro no getnodestate
+    return {
+        'status': state.get('syncState', 'Online'),  # Fallback to Online
+        'currentBlock': state.get('height', 0),
+        'metrics': _nkn_metrics(state, results.get('neighbor'), results.get('version')),
+    }
+
+async def _tcp_probe(ip: str, ports: list, timeout: float, details: dict) -> Optional[dict]:
+    port, seconds, failure = await race_connect(ip, ports, timeout=timeout)
+    if port is None:
+        details['failure'] = failure
+        return None
+    details['connect_ms'] = _ms(seconds)
+    return {'status': 'Online'}
+
+@register_probe('sentinel', timeout=PROBE_CONNECT_TIMEOUT, concurrency=30)
+async def probe_sentinel(session: aiohttp.ClientSession, node: Node, timeout: float, details: dict) -> Optional[dict]:
+    # For Sentinel, check a few common ports. If any is open, consider it online.
+    return await _tcp_probe(node.ip_address, SENTINEL_PORTS, timeout, details)
+
+@register_probe('mysterium', timeout=5, concurrency=30)
+async def probe_mysterium(session: aiohttp.ClientSession, node: Node, timeout: float, details: dict) -> Optional[dict]:
+    ip = node.ip_address
+    # Healthcheck e ligação TCP em paralelo: a TCP só conta se o healthcheck não obtiver resposta
+    tcp_details = {}
+    tcp_check = asyncio.ensure_future(_tcp_probe(ip, [MYSTERIUM_PORT], min(timeout, PROBE_CONNECT_TIMEOUT), tcp_details))
+    started = time.perf_counter()
+    try:
+        async with session.get(f"http://{ip}:{MYSTERIUM_PORT}/healthcheck", timeout=aiohttp.ClientTimeout(total=timeout),
+                               trace_request_ctx=details) as response:
+            if response.status == 200:
+                data = await response.json()
+                details['rpc_ms'] = _ms(time.perf_counter() - started)
+                if data.get('status') == 'UP':
+                    return {'status': 'Online'}
+            details['failure'] = HTTP_ERROR
+            return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        result = await tcp_check
+        # Sem resposta HTTP: vale o que a ligação TCP mediu
+        details.update(tcp_details)
+        if result is not None:
+            details['failure'] = _http_failure(e)
+        return result
+    finally:
+        tcp_check.cancel()
+
+@register_probe(DEFAULT_PROBE, timeout=5, concurrency=20)
+async def probe_generic(session: aiohttp.ClientSession, node: Node, timeout: float, details: dict) -> Optional[dict]:
+    # Generic check for other networks
+    return await _tcp_probe(node.ip_address, [443], timeout, details)
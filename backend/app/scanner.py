@@ -0,0 +1,137 @@
+import os
+import errno
+import socket
+import struct
+import asyncio
+from typing import Callable, Optional, Tuple
+from dotenv import load_dotenv
+from .instrumentation import CONNECT_RESULTS
+
+load_dotenv()
+
+# --- Configurações --- #
+SCAN_TIMEOUT = float(os.getenv("SCAN_TIMEOUT", 3))
+
+# Resultado de cada (ip, porta)
+OPEN = "open"
+REFUSED = "refused"
+TIMEOUT = "timeout"
+UNREACHABLE = "unreachable"  # erro ICMP ou de rota (host/rede inalcançável, nome que não resolve)
+ERROR = "error"              # falha local (ex.: sem descritores livres), não diz nada sobre o nó
+
+# Contadores já ligados ao rótulo: registar um resultado é só um incremento
+_RESULT_COUNTERS = {result: CONNECT_RESULTS.labels(result) for result in (OPEN, REFUSED, TIMEOUT, UNREACHABLE, ERROR)}
+
+_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN}
+_LINGER_RESET = struct.pack("ii", 1, 0)
+
+def _classify(code: int) -> str:
+    if code == 0:
+        return OPEN
+    if code == errno.ECONNREFUSED:
+        return REFUSED
+    if code == errno.ETIMEDOUT:
+        return TIMEOUT
+    return UNREACHABLE
+
+def _numeric_address(ip: str, port: int):
+    """(família, sockaddr) de um IP literal, sem DNS; None se `ip` for um nome."""
+    try:
+        family, _, _, _, sockaddr = socket.getaddrinfo(ip, port, type=socket.SOCK_STREAM, flags=socket.AI_NUMERICHOST)[0]
+    except socket.gaierror:
+        return None
+    return family, sockaddr
+
+class _ConnectAttempt:
+    """
+    Uma tentativa de ligação num socket não bloqueante, registada no selector
+    (epoll) do próprio event loop. Não cria transporte, StreamReader/Writer
+    nem tarefa: o resultado chega ao callback quando o socket fica gravável
+    (SO_ERROR diz se ligou) ou quando expira o timeout.
+    """
+
+    __slots__ = ("loop", "address", "callback", "sock", "fd", "timer")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, address, callback: Callable):
+        self.loop = loop
+        self.address = address
+        self.callback = callback
+        self.sock = None
+        self.fd = None
+        self.timer = None
+
+    def _report(self, result: str):
+        _RESULT_COUNTERS[result].inc()
+        self.callback(result)
+
+    def start(self, timeout: float):
+        if self.address is None:
+            self._report(UNREACHABLE)
+            return
+        family, sockaddr = self.address
+        try:
+            self.sock = socket.socket(family, socket.SOCK_STREAM)
+        except OSError:
+            self._report(ERROR)
+            return
+        self.sock.setblocking(False)
+        try:
+            code = self.sock.connect_ex(sockaddr)
+        except OSError as e:
+            code = e.errno
+        if code not in _IN_PROGRESS:
+            self._finish(_classify(code))
+            return
+        self.fd = self.sock.fileno()
+        self.loop.add_writer(self.fd, self._on_writable)
+        self.timer = self.loop.call_later(timeout, self._finish, TIMEOUT)
+
+    def _on_writable(self):
+        if self.sock is not None:
+            self._finish(_classify(self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)))
+
+    def _release(self, result: Optional[str]):
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.fd is not None:
+            self.loop.remove_writer(self.fd)
+        if result == OPEN:
+            # Fecha com RST: a ligação só serviu para ver a porta aberta, não fica em TIME_WAIT deste lado
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RESET)
+        self.sock.close()
+        self.sock = None
+
+    def _finish(self, result: str):
+        if self.sock is None:
+            return
+        self._release(result)
+        self._report(result)
+
+    def cancel(self):
+        if self.sock is not None:
+            self._release(None)
+
+async def connect_timed(ip: str, port: int, timeout: float = SCAN_TIMEOUT) -> Tuple[str, float]:
+    """
+    Estado de uma porta (OPEN, REFUSED, TIMEOUT, UNREACHABLE ou ERROR) e os
+    segundos até ao resultado. Nomes de host são resolvidos antes, sem
+    bloquear o loop, e a resolução não conta para o tempo.
+    """
+    loop = asyncio.get_running_loop()
+    address = _numeric_address(ip, port)
+    if address is None:
+        try:
+            family, _, _, _, sockaddr = (await loop.getaddrinfo(ip, port, type=socket.SOCK_STREAM))[0]
+            address = (family, sockaddr)
+        except (socket.gaierror, UnicodeError):
+            _RESULT_COUNTERS[UNREACHABLE].inc()
+            return UNREACHABLE, 0.0
+    future = loop.create_future()
+    attempt = _ConnectAttempt(loop, address, lambda result: future.done() or future.set_result(result))
+    started = loop.time()
+    attempt.start(timeout)
+    try:
+        result = await future
+    finally:
+        attempt.cancel()
+    return result, loop.time() - started
@@ -0,0 +1,144 @@
+"""
+Benchmark da verificação de portas TCP em loopback.
+
+Compara o caminho antigo (asyncio.open_connection + close + wait_closed
+por alvo) com o que as sondas usam: connect_timed de app.scanner e
+race_connect de app.probes, todos limitados pelo mesmo semáforo.
+Nas ligações simples metade dos alvos tem a porta aberta e a outra metade
+recusa a ligação; no race_connect cada IP tenta as duas portas, primeiro
+sem porta conhecida e depois com a que respondeu na ronda anterior.
+Os IPs vão de 127.0.0.1 em diante, para não repetir o mesmo destino.
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_connect_scan              # 10 000 alvos
+    python -m benchmarks.bench_connect_scan 50000 2000   # alvos, ligações em curso
+Cada ligação em curso ocupa um descritor: confirme `ulimit -n`.
+Importar app.probes carrega os modelos: defina CRYPTO_KEY como para a API.
+"""
+import asyncio
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+from app.probes import _open_ports, race_connect
+from app.scanner import OPEN, REFUSED, connect_timed
+
+TARGETS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+TIMEOUT = 3
+
+
+def start_acceptor() -> int:
+    """Servidor que aceita e fecha logo cada ligação, numa thread à parte."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("0.0.0.0", 0))
+    server.listen(4096)
+
+    def accept_forever():
+        while True:
+            conn, _ = server.accept()
+            conn.close()
+
+    threading.Thread(target=accept_forever, daemon=True).start()
+    return server.getsockname()[1]
+
+
+def closed_port() -> int:
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(("0.0.0.0", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def build_targets(open_port: int, refused_port: int) -> list:
+    targets = []
+    for i in range(TARGETS):
+        ip = f"127.{(i >> 16) & 255}.{(i >> 8) & 255}.{(i & 255) or 1}"
+        targets.append((ip, open_port if i % 2 == 0 else refused_port))
+    return targets
+
+
+async def old_connect(ip: str, port: int) -> str:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), TIMEOUT)
+    except ConnectionRefusedError:
+        return REFUSED
+    except (OSError, asyncio.TimeoutError):
+        return "other"
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return OPEN
+
+
+async def gather_limited(check, targets) -> dict:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def limited(ip, port):
+        async with semaphore:
+            return await check(ip, port)
+
+    results = await asyncio.gather(*(limited(ip, port) for ip, port in targets))
+    return dict(zip(targets, results))
+
+
+async def run_old(targets):
+    return await gather_limited(old_connect, targets)
+
+
+async def run_connect_timed(targets):
+    async def check(ip, port):
+        result, _ = await connect_timed(ip, port, TIMEOUT)
+        return result
+    return await gather_limited(check, targets)
+
+
+async def race(ip, ports):
+    port, _, failure = await race_connect(ip, ports, timeout=TIMEOUT)
+    return OPEN if port is not None else failure
+
+
+async def run_race_cold(targets):
+    _open_ports.clear()
+    return await gather_limited(race, targets)
+
+
+async def run_race_warm(targets):
+    return await gather_limited(race, targets)
+
+
+def measure(runner, targets):
+    """Tempo sem tracemalloc (que pesa mais nos caminhos com mais objetos) e pico de memória numa segunda passagem."""
+    start = time.perf_counter()
+    results = asyncio.run(runner(targets))
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    asyncio.run(runner(targets))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    counts = {}
+    for result in results.values():
+        counts[result] = counts.get(result, 0) + 1
+    return elapsed, peak, counts
+
+
+if __name__ == "__main__":
+    open_port, refused_port = start_acceptor(), closed_port()
+    targets = build_targets(open_port, refused_port)
+    race_targets = [(ip, (refused_port, open_port)) for ip, _ in targets]
+    print(f"{TARGETS} alvos em loopback, {CONCURRENCY} ligações em curso, timeout {TIMEOUT}s")
+    print(f"{'caminho':<36} {'tempo (s)':>10} {'alvos/s':>10} {'pico mem (MB)':>14}  resultados")
+    for label, runner, runner_targets in [
+        ("open_connection (antigo)", run_old, targets),
+        ("connect_timed", run_connect_timed, targets),
+        ("race_connect (sem porta conhecida)", run_race_cold, race_targets),
+        ("race_connect (porta conhecida)", run_race_warm, race_targets),
+    ]:
+        elapsed, peak, counts = measure(runner, runner_targets)
+        print(f"{label:<36} {elapsed:>10.3f} {TARGETS / elapsed:>10.0f} {peak / 2**20:>14.1f}  {counts}")
@@ -0,0 +1,114 @@
+"""
+Benchmark da importação de nós a partir do CSV.
+
+Compara o caminho antigo (um SELECT + setattr por nó atualizado e um
+db.add por nó novo, em lotes de 100) com run_import_job (um único
+INSERT ... ON CONFLICT por lote).
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_import                 # SQLite temporário
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_import 10000
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from cryptography.fernet import Fernet
+
+_tmpdir = tempfile.mkdtemp(prefix="nodemon-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}")
+os.environ.setdefault("CRYPTO_KEY", Fernet.generate_key().decode())
+
+from app.database import Base, SessionLocal, get_engine  # noqa: E402
+from app.models import ImportJob, IpLocation, Node  # noqa: E402
+from app.changes import next_node_version  # noqa: E402
+from app import imports  # noqa: E402
+
+SIZES = [int(n) for n in sys.argv[1:]] or [1_000, 10_000]
+
+Base.metadata.create_all(bind=get_engine())
+# Sem geolocalização remota: mede só a gravação
+imports.fill_pending_locations = lambda node_ids=None: None
+
+
+def _ip(i: int) -> str:
+    return f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+
+
+def _row(i: int, suffix: str) -> dict:
+    return {
+        "name": f"node-{i}-{suffix}", "ip_address": _ip(i), "secondary_ip": None,
+        "vps_provider": "RN", "wallet_address": "NKNbench", "network": "nkn",
+    }
+
+
+def seed(existing: int):
+    """Deixa `existing` nós na tabela, todos com localização em cache."""
+    db = SessionLocal()
+    try:
+        db.query(Node).delete()
+        db.query(IpLocation).delete()
+        db.bulk_insert_mappings(Node, [{**_row(i, "old"), "id": i + 1, "location": "Lisbon, Portugal"} for i in range(existing)])
+        db.bulk_insert_mappings(IpLocation, [
+            {"ip_address": _ip(i), "location": "Lisbon, Portugal", "found": True, "source": "bench", "updated_at": datetime.utcnow()}
+            for i in range(existing * 2)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def old_path(nodes_to_create, nodes_to_update):
+    db = SessionLocal()
+    try:
+        for i in range(0, len(nodes_to_create), 100):
+            batch = nodes_to_create[i:i + 100]
+            version = next_node_version(db)
+            for node_data in batch:
+                db.add(Node(**node_data, location="Lisbon, Portugal", row_version=version))
+            db.commit()
+        version = next_node_version(db)
+        for node_update_data in nodes_to_update:
+            db_node = db.query(Node).filter(Node.ip_address == node_update_data["ip_address"]).first()
+            if db_node:
+                for key, value in node_update_data.items():
+                    setattr(db_node, key, value)
+                db_node.row_version = version
+        db.commit()
+    finally:
+        db.close()
+
+
+def new_path(nodes_to_create, nodes_to_update):
+    db = SessionLocal()
+    try:
+        job_id = uuid.uuid4().hex
+        db.add(ImportJob(id=job_id, total_rows=len(nodes_to_create) + len(nodes_to_update), errors="[]", created_at=datetime.utcnow()))
+        db.commit()
+    finally:
+        db.close()
+    imports.run_import_job(job_id, nodes_to_create, nodes_to_update)
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print(f"Base de dados: {os.environ['DATABASE_URL'].split('@')[-1]}")
+    print("Cada importação: metade dos nós já existe (sobrescrita), metade é nova.")
+    print(f"{'nós':>8} {'antigo (s)':>12} {'upsert (s)':>12} {'ganho':>8}")
+    for size in SIZES:
+        half = size // 2
+        nodes_to_update = [_row(i, "csv") for i in range(half)]
+        nodes_to_create = [_row(i, "csv") for i in range(half, size)]
+        seed(half)
+        t_old = timed(old_path, nodes_to_create, nodes_to_update)
+        seed(half)
+        t_new = timed(new_path, nodes_to_create, nodes_to_update)
+        print(f"{size:>8} {t_old:>12.3f} {t_new:>12.3f} {t_old / t_new:>7.1f}x")
@@ -0,0 +1,102 @@
+"""
+Benchmark da gravação dos resultados de uma varredura de status.
+
+Compara o caminho antigo (um SELECT por nó seguido de um commit único) com
+persist_poll_results (gravação em lote apenas dos nós alterados).
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_writeback                 # SQLite temporário
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_writeback
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from cryptography.fernet import Fernet
+
+_tmpdir = tempfile.mkdtemp(prefix="nodemon-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}")
+os.environ.setdefault("CRYPTO_KEY", Fernet.generate_key().decode())
+os.environ.setdefault("SMTP_SERVER", "")  # sem alertas por email durante o benchmark
+
+from app.database import Base, SessionLocal, get_engine  # noqa: E402
+from app.models import Node  # noqa: E402
+from app.poller import persist_poll_results  # noqa: E402
+
+SIZES = [int(n) for n in sys.argv[1:]] or [1_000, 10_000, 50_000]
+CHANGE_RATIO = 0.05
+
+Base.metadata.create_all(bind=get_engine())
+
+
+def seed(n: int):
+    db = SessionLocal()
+    try:
+        db.query(Node).delete()
+        db.bulk_insert_mappings(Node, [
+            {
+                "id": i + 1, "name": f"node-{i}", "ip_address": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+                "vps_provider": "RN", "wallet_address": "NKNbench", "network": "nkn",
+                "status": "PERSIST_FINISHED", "currentBlock": 1000,
+            }
+            for i in range(n)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def fake_results(n: int):
+    results = []
+    for node_id in range(1, n + 1):
+        if random.random() < CHANGE_RATIO:
+            results.append((node_id, {"status": "SYNC_STARTED", "currentBlock": 999}))
+        else:
+            results.append((node_id, {"status": "PERSIST_FINISHED", "currentBlock": 1000}))
+    return results
+
+
+def old_path(results):
+    db = SessionLocal()
+    try:
+        for node_id, new_status in results:
+            node = db.query(Node).filter(Node.id == node_id).first()
+            if node:
+                node.status = new_status['status']
+                node.currentBlock = new_status['currentBlock']
+                node.lastUpdate = datetime.now(timezone.utc)
+        db.commit()
+    finally:
+        db.close()
+
+
+def new_path(results):
+    db = SessionLocal()
+    try:
+        nodes = db.query(Node).all()
+        db.expunge_all()
+        persist_poll_results(db, {node.id: node for node in nodes}, results)
+    finally:
+        db.close()
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    print(f"Base de dados: {os.environ['DATABASE_URL'].split('@')[-1]}")
+    print(f"{'nós':>8} {'antigo (s)':>12} {'lote (s)':>10} {'ganho':>8}")
+    for size in SIZES:
+        results = fake_results(size)
+        seed(size)
+        t_old = timed(old_path, results)
+        seed(size)
+        t_new = timed(new_path, results)
+        print(f"{size:>8} {t_old:>12.3f} {t_new:>10.3f} {t_old / t_new:>7.1f}x")
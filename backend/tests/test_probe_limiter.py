@@ -0,0 +1,43 @@
+import asyncio
+
+from app import probes
+from app.probes import ProbeLimiter, ProbeSpec
+
+PROVIDER = "fornecedor-de-teste"
+RATE = 20  # verificações por segundo do fornecedor
+SLOTS = 4
+NODES = 16
+SATURATED_FOR = 0.5  # segundos em que a primeira leva ocupa todas as vagas (ex.: timeouts)
+
+
+class FakeNode:
+    def __init__(self, index: int):
+        self.vps_provider = PROVIDER
+        self.ip_address = f"10.{index}.0.1"  # uma /24 por nó: só o ritmo do fornecedor conta
+
+
+def test_same_provider_connects_stay_paced_when_slots_free_together(monkeypatch):
+    """Com as vagas saturadas, os nós em espera não gastam fichas: quando as vagas libertam, as ligações continuam espaçadas."""
+    monkeypatch.setitem(probes._provider_rates, PROVIDER, RATE)
+    monkeypatch.setattr(probes, "PROBE_PROVIDER_BURST", 1)
+    spec = ProbeSpec("teste", probe=None, timeout=5, retries=0, retry_delay=0, concurrency=SLOTS)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        limiter = ProbeLimiter(total=SLOTS)
+        release_at = loop.time() + SATURATED_FOR
+        starts = []
+
+        async def probe(index: int):
+            async with limiter.slot(spec, FakeNode(index)):
+                starts.append(loop.time())
+                # A primeira leva liberta as vagas toda ao mesmo tempo
+                await asyncio.sleep(max(0.0, release_at - loop.time()) if index < SLOTS else 0.01)
+
+        await asyncio.gather(*(probe(i) for i in range(NODES)))
+        return starts
+
+    starts = sorted(asyncio.run(run()))
+    gaps = [later - earlier for earlier, later in zip(starts, starts[1:])]
+    assert len(starts) == NODES
+    assert min(gaps) >= 0.9 / RATE, gaps
@@ -1,4 +1,5 @@
 import React, { useState, useEffect, useCallback, useRef } from 'react';
+import useWebSocket, { ReadyState } from 'react-use-websocket';
 import SshTerminal from './SshTerminal';
 
 const Icon = ({ path, className = "w-6 h-6" }) => ( <svg xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24" strokeWidth={1.5} stroke="currentColor" className={className}><path strokeLinecap="round" strokeLinejoin="round" d={path} /></svg> );
@@ -99,31 +100,43 @@ const NodeModal = ({ isOpen, onClose, onNodeSaved, project, credentials, nodeToE
 };
 
 const CSVImportModal = ({ isOpen, onClose, analysis, onImport, credentials }) => {
-    const [nodesToOverwrite, setNodesToOverwrite] = useState([]);
+    // A análise fica no servidor: aqui só se guardam os duplicados já carregados e os que o utilizador desmarcou
+    const [duplicateNodes, setDuplicateNodes] = useState([]);
+    const [skippedIps, setSkippedIps] = useState([]);
     const [isImporting, setIsImporting] = useState(false);
+    const [importProgress, setImportProgress] = useState(null);
 
     useEffect(() => {
         if (analysis) {
-            // Pre-select all duplicates by default
-            setNodesToOverwrite(analysis.duplicate_nodes.map(n => n.ip_address));
+            // All duplicates are overwritten by default
+            setDuplicateNodes(analysis.duplicate_nodes);
+            setSkippedIps([]);
         }
     }, [analysis]);
 
     const handleToggleOverwrite = (ip_address) => {
-        setNodesToOverwrite(prev => 
+        setSkippedIps(prev =>
             prev.includes(ip_address) ? prev.filter(ip => ip !== ip_address) : [...prev, ip_address]
         );
     };
 
+    const handleLoadMoreDuplicates = async () => {
+        try {
+            const response = await fetch(`/api/nodes/upload-csv/${analysis.import_id}/rows?kind=duplicate&offset=${duplicateNodes.length}`, { headers: { 'Authorization': credentials } });
+            if (!response.ok) throw new Error('Falha ao carregar mais duplicados.');
+            const rows = await response.json();
+            setDuplicateNodes(prev => [...prev, ...rows]);
+        } catch (error) {
+            alert(`Erro: ${error.message}`);
+        }
+    };
+
     const handleImportClick = async () => {
         setIsImporting(true);
-        const payload = {
-            nodes_to_create: analysis.new_nodes,
-            nodes_to_update: analysis.duplicate_nodes.filter(n => nodesToOverwrite.includes(n.ip_address))
-        };
+        const payload = { overwrite_duplicates: true, skip_ips: skippedIps };
 
         try {
-            const response = await fetch('/api/nodes/import-processed-nodes/', {
+            const response = await fetch(`/api/nodes/upload-csv/${analysis.import_id}/import`, {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json', 'Authorization': credentials },
                 body: JSON.stringify(payload)
@@ -134,13 +147,25 @@ const CSVImportModal = ({ isOpen, onClose, analysis, onImport, credentials }) =>
                 throw new Error(errorData.detail || 'Falha ao executar a importação.');
             }
 
-            const result = await response.json();
-            alert(result.message);
+            // A importação corre em segundo plano: acompanha o job até terminar
+            const { job_id } = await response.json();
+            let job;
+            do {
+                await new Promise(resolve => setTimeout(resolve, 1000));
+                const jobResponse = await fetch(`/api/nodes/import-jobs/${job_id}`, { headers: { 'Authorization': credentials } });
+                if (!jobResponse.ok) throw new Error('Falha ao consultar o progresso da importação.');
+                job = await jobResponse.json();
+                setImportProgress(job);
+            } while (job.status === 'queued' || job.status === 'running');
+
+            if (job.status === 'failed') throw new Error(job.errors[job.errors.length - 1] || 'A importação falhou.');
+            alert(job.errors.length ? `${job.message}\n${job.errors.length} erros:\n${job.errors.join('\n')}` : job.message);
             onImport(); // This will refresh the main dashboard
         } catch (error) {
             alert(`Erro: ${error.message}`);
         } finally {
             setIsImporting(false);
+            setImportProgress(null);
         }
     };
 
@@ -154,11 +179,11 @@ const CSVImportModal = ({ isOpen, onClose, analysis, onImport, credentials }) =>
                 {analysis ? (
                     <div className="flex-grow overflow-y-auto">
                         <div className="space-y-4 text-gray-300">
-                            <p><span className="font-semibold text-green-400">{analysis.new_nodes.length}</span> nós novos prontos para serem importados.</p>
-                            <p><span className="font-semibold text-yellow-400">{analysis.duplicate_nodes.length}</span> nós duplicados (IP já existe).</p>
-                            {analysis.errors.length > 0 && (
+                            <p><span className="font-semibold text-green-400">{analysis.new_count}</span> nós novos prontos para serem importados.</p>
+                            <p><span className="font-semibold text-yellow-400">{analysis.duplicate_count}</span> nós duplicados (IP já existe).</p>
+                            {analysis.error_count > 0 && (
                                 <div>
-                                    <p className="font-semibold text-red-400">{analysis.errors.length} erros encontrados no arquivo:</p>
+                                    <p className="font-semibold text-red-400">{analysis.error_count} erros encontrados no arquivo{analysis.error_count > analysis.errors.length ? ` (primeiros ${analysis.errors.length})` : ''}:</p>
                                     <ul className="list-disc list-inside text-red-400/80 text-sm">
                                         {analysis.errors.map((err, i) => <li key={i}>{err}</li>)}
                                     </ul>
@@ -166,16 +191,16 @@ const CSVImportModal = ({ isOpen, onClose, analysis, onImport, credentials }) =>
                             )}
                         </div>
 
-                        {analysis.duplicate_nodes.length > 0 && (
+                        {analysis.duplicate_count > 0 && (
                             <div className="mt-6">
                                 <h3 className="font-semibold mb-2 text-white">Sobrescrever Nós Duplicados?</h3>
                                 <p className="text-sm text-gray-400 mb-3">Selecione os nós que deseja atualizar com os dados do CSV. Os não selecionados serão ignorados.</p>
                                 <div className="bg-gray-900/50 rounded-lg p-3 max-h-60 overflow-y-auto">
-                                    {analysis.duplicate_nodes.map(node => (
+                                    {duplicateNodes.map(node => (
                                         <label key={node.ip_address} className="flex items-center space-x-3 p-2 hover:bg-gray-700/50 rounded-md">
                                             <input 
                                                 type="checkbox" 
-                                                checked={nodesToOverwrite.includes(node.ip_address)}
+                                                checked={!skippedIps.includes(node.ip_address)}
                                                 onChange={() => handleToggleOverwrite(node.ip_address)}
                                                 className="w-4 h-4 text-indigo-600 bg-gray-700 border-gray-600 rounded focus:ring-indigo-500 shrink-0"
                                             />
@@ -183,6 +208,11 @@ const CSVImportModal = ({ isOpen, onClose, analysis, onImport, credentials }) =>
                                             <span className="text-sm text-gray-400 truncate">({node.name})</span>
                                         </label>
                                     ))}
+                                    {duplicateNodes.length < analysis.duplicate_count && (
+                                        <button onClick={handleLoadMoreDuplicates} className="w-full mt-2 py-1 text-sm text-indigo-400 hover:text-indigo-300">
+                                            Mostrar mais ({analysis.duplicate_count - duplicateNodes.length} restantes)
+                                        </button>
+                                    )}
                                 </div>
                             </div>
                         )}
@@ -198,7 +228,7 @@ const CSVImportModal = ({ isOpen, onClose, analysis, onImport, credentials }) =>
                         disabled={!analysis || isImporting}
                         className="py-2 px-5 bg-indigo-600 hover:bg-indigo-500 rounded-md text-white font-semibold disabled:opacity-50 disabled:cursor-wait"
                     >
-                        {isImporting ? 'A Importar...' : 'Executar Importação'}
+                        {isImporting ? (importProgress ? `A Importar... ${importProgress.processed_rows}/${importProgress.total_rows}` : 'A Importar...') : 'Executar Importação'}
                     </button>
                 </div>
             </div>
@@ -356,6 +386,7 @@ const Dashboard = ({ project, credentials, setSidebarOpen }) => {
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
     const [globalStat, setGlobalStat] = useState({ label: '...', value: '...' });
+    const [lastPollAt, setLastPollAt] = useState(null);
     const [isNodeModalOpen, setNodeModalOpen] = useState(false);
     const [isImportModalOpen, setImportModalOpen] = useState(false);
     const [importAnalysis, setImportAnalysis] = useState(null);
@@ -400,6 +431,12 @@ const Dashboard = ({ project, credentials, setSidebarOpen }) => {
                 const data = await response.json();
                 setGlobalStat(data);
             }
+            // A hora da última verificação é da frota inteira; o lastUpdate de cada nó é a da última alteração
+            const pollerResponse = await fetch('/api/poller/status', { headers: { 'Authorization': credentials } });
+            if (pollerResponse.ok) {
+                const pollerStatus = await pollerResponse.json();
+                setLastPollAt(pollerStatus.last_poll_at);
+            }
         } catch (e) {
             console.error("Erro ao buscar status global:", e);
         }
@@ -453,11 +490,52 @@ const Dashboard = ({ project, credentials, setSidebarOpen }) => {
         handleRefresh();
     };
 
+    // Atualizações em tempo real: snapshot inicial e depois só as alterações de cada nó
+    const applyNodeUpdate = useCallback((event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'snapshot') {
+            setNodes(message.nodes);
+            setLoading(false);
+        } else if (message.type === 'changes') {
+            setNodes(prev => {
+                const changed = new Map(message.changed.map(node => [node.id, node]));
+                const deleted = new Set(message.deleted);
+                const next = prev.filter(node => !deleted.has(node.id)).map(node => {
+                    const updated = changed.get(node.id);
+                    changed.delete(node.id);
+                    return updated || node;
+                });
+                return [...next, ...changed.values()];
+            });
+        }
+    }, []);
+
+    const { sendJsonMessage, readyState } = useWebSocket(
+        // O parâmetro só força uma nova ligação ao trocar de rede; a rede segue na mensagem de autenticação
+        `${window.location.protocol === 'https:' ? 'wss:' : 'ws:'}//${window.location.host}/ws/nodes?network=${project}`,
+        {
+            onOpen: () => sendJsonMessage({ type: 'auth', credentials, network: project }),
+            onMessage: applyNodeUpdate,
+            shouldReconnect: (event) => event.code !== 1008,
+            reconnectInterval: 5000,
+        }
+    );
+    const liveUpdates = readyState === ReadyState.OPEN;
+
     useEffect(() => {
-        handleRefresh();
-        const interval = setInterval(handleRefresh, 60000);
+        fetchGlobalStat();
+    }, [fetchGlobalStat]);
+
+    useEffect(() => {
+        // Sem canal em tempo real (falha ou recusa), volta a carregar a lista completa
+        if (readyState === ReadyState.CLOSED) fetchNodes();
+    }, [readyState, fetchNodes]);
+
+    useEffect(() => {
+        // Com o canal em tempo real ligado, só o status global continua a ser consultado periodicamente
+        const interval = setInterval(liveUpdates ? fetchGlobalStat : handleRefresh, 60000);
         return () => clearInterval(interval);
-    }, [handleRefresh]);
+    }, [liveUpdates, fetchGlobalStat, handleRefresh]);
 
     const handleOpenNodeModal = (node = null) => {
         setNodeToEdit(node);
@@ -560,9 +638,14 @@ const Dashboard = ({ project, credentials, setSidebarOpen }) => {
                         </button>
                         <h2 className="text-2xl sm:text-3xl font-bold">{projectTitle[project]}</h2>
                     </div>
-                    <div className="flex items-center bg-gray-900 px-4 py-2 rounded-lg">
-                        <span className="text-sm text-gray-400 mr-2">{globalStat.label}:</span>
-                        <span className="text-lg font-semibold text-green-400">{globalStat.value}</span>
+                    <div className="flex items-center gap-4">
+                        {lastPollAt && (
+                            <span className="text-sm text-gray-400">Última verificação: {new Date(lastPollAt).toLocaleString()}</span>
+                        )}
+                        <div className="flex items-center bg-gray-900 px-4 py-2 rounded-lg">
+                            <span className="text-sm text-gray-400 mr-2">{globalStat.label}:</span>
+                            <span className="text-lg font-semibold text-green-400">{globalStat.value}</span>
+                        </div>
                     </div>
                 </div>
             </header>
@@ -675,7 +758,7 @@ const Dashboard = ({ project, credentials, setSidebarOpen }) => {
                                 <th scope="col" className="px-6 py-3 hidden lg:table-cell">Provedor / Carteira</th>
                                 <th scope="col" className="px-6 py-3">Status</th>
                                 <th scope="col" className="px-6 py-3 text-right">Bloco / Info</th>
-                                <th scope="col" className="px-6 py-3 text-right hidden md:table-cell">Última Atualização</th>
+                                <th scope="col" className="px-6 py-3 text-right hidden md:table-cell">Última Alteração</th>
                                 <th scope="col" className="px-6 py-3 text-center">Ações</th>
                             </tr>
                         </thead>